@@ -0,0 +1,88 @@
+"""Compare approximate nearest-neighbour backends against the exact Flat index
+
+Reports build time, mean query latency and recall@k (overlap with the Flat
+results) for every backend and search setting.
+
+Usage (from the code directory):
+    python -m benchmarks.bench_ann
+    python -m benchmarks.bench_ann --vectors embeddings.npy --nprobe 4 8 16 --ef-search 32 64 128
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.utils.ann_index import ANNIndex
+
+
+def synthetic_vectors(n, dim, clusters, seed):
+    """Clustered vectors, screenshots of one screen embed close to each other"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(clusters, size=n)
+    return centers[labels] + 0.3 * rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def build(index, vectors):
+    t0 = time.perf_counter()
+    index.add(vectors, range(len(vectors)))
+    return time.perf_counter() - t0
+
+
+def measure(index, queries, k, exact=None):
+    t0 = time.perf_counter()
+    ids = np.vstack([index.search(query[None, :], k)[1] for query in queries])
+    latency_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    recall = 1.0
+    if exact is not None:
+        recall = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, exact)]))
+    return latency_ms, recall, ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", help="Corpus as an (N, d) .npy file instead of synthetic data")
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--pq-m", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.ascontiguousarray(np.load(args.vectors), dtype=np.float32)
+    else:
+        vectors = synthetic_vectors(args.n, args.dim, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    picks = rng.choice(len(vectors), size=args.queries, replace=False)
+    queries = vectors[picks] + 0.1 * rng.normal(size=(args.queries, vectors.shape[1])).astype(np.float32)
+    print(f"{len(vectors)} vectors of dimension {vectors.shape[1]}, {args.queries} queries, k={args.k}")
+
+    flat = ANNIndex('flat')
+    build_s = build(flat, vectors)
+    latency_ms, recall, exact = measure(flat, queries, args.k)
+    rows = [("flat", build_s, latency_ms, recall)]
+    for kind in ("ivf_flat", "ivf_pq"):
+        index = ANNIndex(kind, nlist=args.nlist, pq_m=args.pq_m)
+        build_s = build(index, vectors)
+        for nprobe in args.nprobe:
+            index.set_search_parameters(nprobe=nprobe)
+            rows.append((f"{index.kind} nprobe={nprobe}", build_s) + measure(index, queries, args.k, exact)[:2])
+    index = ANNIndex("hnsw")
+    build_s = build(index, vectors)
+    for ef_search in args.ef_search:
+        index.set_search_parameters(ef_search=ef_search)
+        rows.append((f"hnsw efSearch={ef_search}", build_s) + measure(index, queries, args.k, exact)[:2])
+
+    print(f"\n{'backend':<24} {'build_s':>8} {'latency_ms':>11} {'recall@k':>9}")
+    for name, build_s, latency_ms, recall in rows:
+        print(f"{name:<24} {build_s:>8.2f} {latency_ms:>11.3f} {recall:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Compare CPU inference profiles of the local GME model
+
+Embeds the same texts and screenshots with every profile and reports
+throughput (items/s) and the cosine similarity of each embedding to the
+reference profile (the first one, float32 by default).
+
+Usage (from the code directory):
+    python -m benchmarks.bench_gme_cpu
+    python -m benchmarks.bench_gme_cpu --profiles float32 bfloat16 float32+int8 float32+compile --threads 8
+"""
+import argparse
+import gc
+import time
+
+import torch
+
+from demo import load_record_data
+from src.models.gme_model import GmeQwen2VL
+
+
+def parse_profile(profile):
+    """'dtype[+int8][+compile]'"""
+    dtype, *flags = profile.split("+")
+    return {"dtype": dtype, "quantize": "int8" in flags, "compile_model": "compile" in flags}
+
+
+def embed(model, texts, images, batch_size):
+    """Embed texts and images, returning the embeddings and the elapsed seconds"""
+    t0 = time.perf_counter()
+    text_embeddings = model.get_text_embeddings(texts, batch_size=batch_size, show_progress_bar=False)
+    image_embeddings = model.get_image_embeddings(images, is_query=False, batch_size=batch_size,
+                                                  show_progress_bar=False)
+    elapsed = time.perf_counter() - t0
+    return torch.cat([text_embeddings, image_embeddings]).float(), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", default="data_demo/record.json")
+    parser.add_argument("--model", default="Alibaba-NLP/gme-Qwen2-VL-2B-Instruct")
+    parser.add_argument("--profiles", nargs="+", default=["float32", "bfloat16", "float32+int8"])
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--limit", type=int, default=16, help="Number of texts and of screenshots")
+    parser.add_argument("--batch-size", type=int, default=4)
+    args = parser.parse_args()
+
+    actions, screenshots, _ = load_record_data(args.record)
+    texts = actions[:args.limit]
+    images = list(dict.fromkeys(screenshots))[:args.limit]
+    items = len(texts) + len(images)
+    print(f"{len(texts)} texts and {len(images)} screenshots per profile")
+
+    reference = None
+    for profile in args.profiles:
+        model = GmeQwen2VL(args.model, device="cpu", num_threads=args.threads, **parse_profile(profile))
+        # Warm up so lazy initialization and compilation are not timed
+        embed(model, texts[:1], images[:1], 1)
+        embeddings, elapsed = embed(model, texts, images, args.batch_size)
+        if reference is None:
+            reference = embeddings
+        cosines = torch.nn.functional.cosine_similarity(embeddings, reference, dim=1)
+        print(f"{profile:<20} items/s={items / elapsed:7.2f}  "
+              f"cos_mean={cosines.mean().item():.4f}  cos_min={cosines.min().item():.4f}")
+        del model
+        gc.collect()
+
+    print(f"\nCosine similarities are relative to the first profile ({args.profiles[0]})")
+
+
+if __name__ == "__main__":
+    main()
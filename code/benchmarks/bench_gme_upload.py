@@ -0,0 +1,86 @@
+"""Compare GmeAPI screenshot upload variants
+
+Reports uploaded bytes and preparation time per screenshot for raw files and
+re-encoded variants, and with --live the embedding latency, cosine drift
+against the raw upload and nearest-neighbour agreement with it.
+
+Usage (from the code directory):
+    python -m benchmarks.bench_gme_upload
+    python -m benchmarks.bench_gme_upload --live --api-key KEY --variants raw jpeg:85 jpeg:70 webp:80
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from demo import load_record_data
+from src.models.gme_model import GmeAPI
+
+
+def parse_variant(variant):
+    """'raw' or 'format:quality'"""
+    if variant == "raw":
+        return None, 85
+    upload_format, quality = variant.split(":")
+    return upload_format, int(quality)
+
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def nearest_neighbours(vectors):
+    similarities = vectors @ vectors.T
+    np.fill_diagonal(similarities, -np.inf)
+    return similarities.argmax(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", default="data_demo/record.json")
+    parser.add_argument("--limit", type=int, default=50, help="Number of screenshots")
+    parser.add_argument("--variants", nargs="+", default=["raw", "jpeg:85", "jpeg:70", "webp:80"])
+    parser.add_argument("--max-pixels", type=int, default=1280 * 28 * 28)
+    parser.add_argument("--live", action="store_true", help="Embed every variant through the API")
+    parser.add_argument("--api-key")
+    args = parser.parse_args()
+
+    _, screenshots, _ = load_record_data(args.record)
+    # Unique files, the record repeats screenshots between actions
+    screenshots = list(dict.fromkeys(screenshots))[:args.limit]
+    print(f"{len(screenshots)} screenshots")
+
+    rows = []
+    reference = None
+    for variant in args.variants:
+        upload_format, quality = parse_variant(variant)
+        client = GmeAPI(args.api_key, upload_format=upload_format, upload_quality=quality,
+                        upload_max_pixels=args.max_pixels)
+        sizes, prepare_ms = [], []
+        for path in screenshots:
+            t0 = time.perf_counter()
+            url = client._image_to_base64(path)
+            prepare_ms.append((time.perf_counter() - t0) * 1000)
+            sizes.append(len(url))
+        row = {"variant": variant, "kb": statistics.mean(sizes) / 1024, "prepare_ms": statistics.mean(prepare_ms)}
+
+        if args.live:
+            t0 = time.perf_counter()
+            vectors = normalize(client.get_image_embeddings(screenshots, show_progress=False))
+            row["embed_ms"] = (time.perf_counter() - t0) * 1000 / len(screenshots)
+            if reference is None:
+                reference = vectors
+            cosines = (vectors * reference).sum(axis=1)
+            row["cos_mean"] = float(cosines.mean())
+            row["cos_min"] = float(cosines.min())
+            row["nn_agree"] = float((nearest_neighbours(vectors) == nearest_neighbours(reference)).mean())
+        rows.append(row)
+        print("  ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items()))
+
+    if args.live:
+        print(f"\nDrift and agreement are relative to the first variant ({args.variants[0]})")
+
+
+if __name__ == "__main__":
+    main()
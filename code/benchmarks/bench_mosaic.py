@@ -0,0 +1,89 @@
+"""Compare packed (mosaic) and unpacked window screenshots for segmentation calls
+
+Reports estimated vision tokens and preparation latency per window, and with
+--live the prompt tokens and request latency reported by the API.
+
+Usage (from the code directory):
+    python -m benchmarks.bench_mosaic
+    python -m benchmarks.bench_mosaic --live --api-key KEY --base-url URL
+"""
+import argparse
+import statistics
+import time
+
+from demo import load_record_data
+from src.models.llm_client import estimate_image_tokens
+from src.processors.image_processor import WindowImagePreparer
+
+PROMPT = "Describe in one word what the user is doing in these screenshots."
+
+
+def build_messages(urls, packed):
+    """Build messages the way ActionHistoryProcessor._call_gpt4o does"""
+    if packed:
+        content = [{"type": "text", "text": PROMPT}]
+        content.extend({"type": "image_url", "image_url": {"url": url}} for url in urls)
+        return [{"role": "user", "content": content}]
+    messages = [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": url}}]} for url in urls]
+    messages.append({"role": "user", "content": PROMPT})
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", default="data_demo/record.json")
+    parser.add_argument("--window-size", type=int, default=10)
+    parser.add_argument("--cell-size", type=int, nargs=2, default=(270, 600))
+    parser.add_argument("--columns", type=int, default=4)
+    parser.add_argument("--max-cells", type=int, default=8)
+    parser.add_argument("--live", action="store_true", help="Send both variants to the API")
+    parser.add_argument("--api-key")
+    parser.add_argument("--base-url")
+    parser.add_argument("--model", default="gpt-4o")
+    args = parser.parse_args()
+
+    _, screenshots, _ = load_record_data(args.record)
+    preparer = WindowImagePreparer()
+    client = None
+    if args.live:
+        from openai import OpenAI
+        client = OpenAI(api_key=args.api_key, base_url=args.base_url)
+
+    results = {"unpacked": [], "packed": []}
+    for start in range(0, len(screenshots) - 1, args.window_size):
+        window = screenshots[start:start + args.window_size + 1]
+        # Warm the base image cache so both modes are timed on equal terms
+        preparer.prepare(window)
+        for mode in results:
+            t0 = time.perf_counter()
+            if mode == "packed":
+                images = preparer.prepare_mosaics(window, cell_size=tuple(args.cell_size),
+                                                  columns=args.columns, max_cells=args.max_cells)
+            else:
+                images = preparer.prepare(window)
+            row = {
+                "prepare_ms": (time.perf_counter() - t0) * 1000,
+                "images": len(images),
+                "est_tokens": sum(estimate_image_tokens(i.width, i.height) for i in images),
+            }
+            if client is not None:
+                t0 = time.perf_counter()
+                completion = client.chat.completions.create(
+                    model=args.model,
+                    messages=build_messages([i.url for i in images], mode == "packed"),
+                    max_tokens=1,
+                )
+                row["latency_ms"] = (time.perf_counter() - t0) * 1000
+                row["prompt_tokens"] = completion.usage.prompt_tokens
+            results[mode].append(row)
+            print(f"window@{start:<4} {mode:<9} " + " ".join(
+                f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items()))
+
+    print("\nMean per window:")
+    for mode, rows in results.items():
+        print(f"  {mode:<9} " + " ".join(
+            f"{key}={statistics.mean(r[key] for r in rows):.1f}" for key in rows[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,9 +11,11 @@ def load_record_data(record_path: str):
     
     actions = []
     screenshots = []
+    ui_trees = []
     
-    # Add initial screenshot
+    # Add initial screenshot and UI tree
     screenshots.append(f"data_demo/screenshots/step_0.png")
+    ui_trees.append(f"data_demo/ui_trees/step_0_ui.xml")
     
     # Process each step
     for step in record_data['steps']:
@@ -30,8 +32,9 @@ def load_record_data(record_path: str):
             
         actions.append(action_desc)
         screenshots.append(f"data_demo/screenshots/{step['screen_shot']}")
+        ui_trees.append(f"data_demo/ui_trees/{step['ui_tree']}")
     
-    return actions, screenshots
+    return actions, screenshots, ui_trees
 
 def main():
     # Configure processor
@@ -50,33 +53,39 @@ def main():
     processor = ActionHistoryProcessor(config)
 
     try:
-        # Load record.json data
-        actions, screenshots = load_record_data("data_demo/record.json")
-        
-        print(f"Loaded {len(actions)} actions and {len(screenshots)} screenshots")
-        
-        # Process and save results
-        processor.process_and_save(actions, screenshots, "app_analysis_result.txt")
-        
-        # Build RAG index from processed segments
-        segments_data = []
-        with open("output/segments_data.json", 'r', encoding='utf-8') as f:
-            segments_data = json.load(f)
+        index_dir = Path("output/rag_index")
+        if (index_dir / "manifest.json").exists():
+            # Open the saved memory without re-embedding anything
+            processor.rag_processor.load(index_dir)
+        else:
+            # Load record.json data
+            actions, screenshots, ui_trees = load_record_data("data_demo/record.json")
+            
+            print(f"Loaded {len(actions)} actions and {len(screenshots)} screenshots")
             
-        # Convert segments data to FunctionSegment objects
-        segments = []
-        for data in segments_data:
-            segment = FunctionSegment(
-                actions=data['actions'],
-                screenshots=data['screenshots'],
-                func_desc=data['func_desc'],
-                action_detail=data['action_detail'],
-                reasoning=data['reasoning']
-            )
-            segments.append(segment)
+            # Process and save results
+            processor.process_and_save(actions, screenshots, "output/app_analysis_result.txt", ui_trees)
             
-        # Build RAG index
-        processor.rag_processor.build_index(segments)
+            # Build RAG index from processed segments
+            segments_data = []
+            with open("output/segments_data.json", 'r', encoding='utf-8') as f:
+                segments_data = json.load(f)
+                
+            # Convert segments data to FunctionSegment objects
+            segments = []
+            for data in segments_data:
+                segment = FunctionSegment(
+                    actions=data['actions'],
+                    screenshots=data['screenshots'],
+                    func_desc=data['func_desc'],
+                    action_detail=data['action_detail'],
+                    reasoning=data['reasoning']
+                )
+                segments.append(segment)
+                
+            # Build RAG index and save it for the next start
+            processor.rag_processor.build_index(segments)
+            processor.rag_processor.save(index_dir)
         
         # Example RAG search queries
         print("\nPerforming RAG searches...")
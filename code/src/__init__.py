@@ -1,5 +1,6 @@
 from src.processors.action_processor import ActionHistoryProcessor
+from src.processors.streaming_segmenter import StreamingSegmenter
 from src.config.config import ProcessorConfig
-from src.models.models import FunctionSegment, RAGResult
+from src.models.models import FunctionSegment, RAGQuery, RAGResult
 
-__all__ = ['ActionHistoryProcessor', 'ProcessorConfig', 'FunctionSegment', 'RAGResult'] 
\ No newline at end of file
+__all__ = ['ActionHistoryProcessor', 'StreamingSegmenter', 'ProcessorConfig', 'FunctionSegment', 'RAGQuery', 'RAGResult'] 
\ No newline at end of file
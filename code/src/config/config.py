@@ -1,17 +1,66 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Tuple
 
 class ProcessorConfig(BaseModel):
     """Processor configuration class"""
     api_key: str
     base_url: str
     window_size: int = 10
+    adaptive_window: bool = False
+    min_window_size: int = 4
+    max_window_size: int = 16
     model_name: str = "Alibaba-NLP/gme-Qwen2-VL-2B-Instruct"
     output_dir: str = "output"
     log_file: str = "action_history_processor.log"
     max_retries: int = 3
     timeout: int = 30
+    llm_model: str = "gpt-4o"
+    max_concurrency: int = 8
+    requests_per_minute: int = 500
+    tokens_per_minute: int = 30000  # OpenAI usage tier 1 limit of gpt-4o, raise it to match your tier
+    backoff_base: float = 1.0
+    backoff_max: float = 60.0
+    response_cache_path: Optional[str] = None  # defaults to <output_dir>/llm_response_cache.sqlite
+    response_cache_mode: str = "use"  # 'use', 'refresh' or 'bypass'
+    response_cache_max_bytes: int = 512 * 1024 * 1024
+    local_boundary_detection: bool = True  # only used when UI trees are passed
+    boundary_similarity_threshold: float = 0.3
+    local_segment_max_actions: int = 3  # boundaries within this many actions are cut without a segmentation call
+    local_description_batch: int = 8  # locally cut segments described per text-only LLM call
+    summary_token_budget: int = 8000  # larger summary prompts are summarized hierarchically
+    incremental_summary: bool = False  # merge new segments into the existing memory and summary
+    summary_drift_threshold: float = 0.3  # share of changed segments that triggers a full rebuild
     gme_api_key: str = "api_key"
+    gme_max_batch: int = 10  # texts per DashScope embedding request
+    gme_max_image_batch: int = 1  # images per request, multimodal-embedding-v1 is not confirmed to accept more
+    gme_max_workers: int = 4  # embedding requests in flight
+    gme_upload_format: Optional[str] = None  # 'jpeg' or 'webp' to downscale and re-encode uploads
+    gme_upload_quality: int = 85
+    gme_upload_max_pixels: int = 1280 * 28 * 28
+    embedding_cache_path: Optional[str] = None  # defaults to <output_dir>/embedding_cache.sqlite
+    embedding_cache_mode: str = "use"  # 'use', 'refresh' or 'bypass'
+    embedding_cache_max_bytes: int = 1024 * 1024 * 1024
+    image_max_size: Tuple[int, int] = (800, 800)
+    image_quality: int = 60
+    image_workers: int = 4
+    image_cache_max_bytes: int = 256 * 1024 * 1024
+    rag_index_type: str = "auto"  # 'auto', 'flat', 'ivf_flat', 'ivf_pq' or 'hnsw'
+    rag_nlist: Optional[int] = None  # IVF lists, derived from the corpus size if not set
+    rag_nprobe: int = 8
+    rag_pq_m: int = 16
+    rag_hnsw_m: int = 32
+    rag_ef_search: int = 64
+    rag_fusion: str = "none"  # 'none' lists text and image hits separately, 'rrf' or 'weighted' fuse them
+    rag_fusion_candidates: int = 20  # segments per modality considered for fusion
+    rag_text_weight: float = 0.5  # weighted fusion, images get 1 - rag_text_weight
+    rag_rrf_k: int = 60
+    query_cache_max_bytes: int = 64 * 1024 * 1024  # in-memory query embedding cache, 0 disables it
+    query_cache_ttl: Optional[float] = 600.0  # seconds, None keeps entries until evicted
+    near_duplicate_threshold: Optional[int] = None  # dHash Hamming distance, None disables collapsing
+    pack_screenshots: bool = False  # tile window screenshots into grid images sent in one message
+    mosaic_cell_size: Tuple[int, int] = (270, 600)
+    mosaic_columns: int = 4
+    mosaic_max_cells: int = 8
 
 # Log configuration
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
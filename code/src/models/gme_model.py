@@ -3,19 +3,21 @@ from transformers import AutoModelForVision2Seq, AutoProcessor
 from PIL import Image
 from typing import List, Optional, Dict, Union
 import logging
-import requests
 from io import BytesIO
 import math
 import os
 from torch.utils.data import DataLoader
 from tqdm.autonotebook import tqdm
 import base64
-from io import BytesIO
-import requests
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import dashscope
 from http import HTTPStatus
 import numpy as np
 
+from src.utils.embedding_cache import EmbeddingCache
+from src.utils.image_prefetch import ImagePrefetcher, fetch_image, smart_resize
 
 
 
@@ -27,17 +29,124 @@ def custom_collate_fn(batch):
 
 
 
+# Leading bytes of the image formats DashScope accepts
+_IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+)
+
+UPLOAD_FORMATS = ('jpeg', 'webp')
+
+
+def detect_image_format(data: bytes) -> Optional[str]:
+    """Detect an image format from its magic bytes"""
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    for signature, image_format in _IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return image_format
+    return None
+
+
+class GmeAPIError(Exception):
+    """Failed DashScope embedding call"""
+    def __init__(self, message: str, status_code: Optional[int] = None, retryable: Optional[bool] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self._retryable = retryable
+
+    @property
+    def retryable(self) -> bool:
+        if self._retryable is not None:
+            return self._retryable
+        # Transport errors carry no status code
+        return self.status_code is None or self.status_code in (408, 429) or self.status_code >= 500
+
+
 class GmeAPI:
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, cache: Optional[EmbeddingCache] = None,
+                 model: str = "multimodal-embedding-v1", max_batch: int = 10,
+                 max_image_batch: int = 1, max_workers: int = 4, max_retries: int = 3,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 upload_format: Optional[str] = None, upload_quality: int = 85,
+                 upload_max_pixels: int = 1280 * 28 * 28, upload_fast_path_bytes: int = 256 * 1024):
         """Initialize GME API client
         
         Args:
             api_key: DashScope API key
+            cache: Embedding cache, only inputs missing from it are sent to the API
+            model: DashScope embedding model
+            max_batch: Text inputs sent per request, at most the service limit
+            max_image_batch: Image inputs sent per request; multimodal-embedding-v1
+                is not known to accept several images per call, and a rejected
+                chunk is only retried one image at a time after failing
+            max_workers: Requests in flight at the same time
+            max_retries: Attempts per request before giving up
+            backoff_base: Base delay of the exponential backoff in seconds
+            backoff_max: Maximum delay between attempts in seconds
+            upload_format: 'jpeg' or 'webp' to downscale and re-encode screenshots
+                before upload, None to upload the files unchanged
+            upload_quality: Encoder quality of re-encoded screenshots
+            upload_max_pixels: Pixel budget of uploaded screenshots, by default the
+                largest resolution the GME model resolves
+            upload_fast_path_bytes: Files up to this size are uploaded unchanged when
+                their header shows they are within the pixel budget
         """
+        if upload_format is not None and upload_format not in UPLOAD_FORMATS:
+            raise ValueError(f"Unsupported upload format: {upload_format}, expected one of {UPLOAD_FORMATS}")
         self.api_key = api_key
+        self.cache = cache
+        self.model = model
+        self.max_batch = max_batch
+        self.max_image_batch = max_image_batch
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.upload_format = upload_format
+        self.upload_quality = upload_quality
+        self.upload_max_pixels = upload_max_pixels
+        self.upload_fast_path_bytes = upload_fast_path_bytes
+        # Cached vectors depend on what is uploaded, not only on the file content
+        self.cache_namespace = f"gme_api:{model}"
+        if upload_format is not None:
+            self.cache_namespace += f":{upload_format}:{upload_quality}:{upload_max_pixels}"
         if api_key:
             dashscope.api_key = api_key
 
+    def _prepare_upload(self, image_path: str) -> tuple:
+        """Read a screenshot and, if enabled, downscale and re-encode it for upload
+
+        Returns:
+            tuple: Image bytes and their format
+        """
+        with open(image_path, "rb") as image_file:
+            data = image_file.read()
+        image_format = detect_image_format(data) or image_path.split('.')[-1].lower()
+        if self.upload_format is None:
+            return data, image_format
+
+        with Image.open(BytesIO(data)) as image:
+            # Image.open only parses the header, the fast path never decodes pixels
+            width, height = image.size
+            within_budget = width * height <= self.upload_max_pixels
+            if within_budget and len(data) <= self.upload_fast_path_bytes:
+                return data, image_format
+
+            scale = min(1.0, math.sqrt(self.upload_max_pixels / (width * height)))
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            # JPEG can decode at a reduced scale directly
+            image.draft('RGB', size)
+            image = image.convert('RGB')
+            if image.size != size:
+                image = image.resize(size, Image.Resampling.LANCZOS)
+            output = BytesIO()
+            image.save(output, format=self.upload_format.upper(), quality=self.upload_quality)
+        return output.getvalue(), self.upload_format
+
     def _image_to_base64(self, image_path: str) -> str:
         """Convert image to base64 format
         
@@ -47,11 +156,68 @@ class GmeAPI:
         Returns:
             str: Base64 encoded image data
         """
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-        image_format = image_path.split('.')[-1].lower()
+        data, image_format = self._prepare_upload(image_path)
+        base64_image = base64.b64encode(data).decode('utf-8')
         return f"data:image/{image_format};base64,{base64_image}"
 
+    def _input_item(self, text: Optional[str], image_path: Optional[str]) -> Dict[str, str]:
+        input_data = {'text': text} if text else {}
+        if image_path:
+            input_data['image'] = self._image_to_base64(image_path)
+        return input_data
+
+    def _call(self, inputs: List[Dict[str, str]]) -> List[np.ndarray]:
+        """Embed several inputs in one request, returning vectors in input order"""
+        try:
+            resp = dashscope.MultiModalEmbedding.call(
+                model=self.model,
+                input=inputs
+            )
+        except Exception as e:
+            raise GmeAPIError(f"GME API call failed: {str(e)}") from e
+
+        if resp.status_code != HTTPStatus.OK:
+            raise GmeAPIError(f"GME API call failed: {resp.message}", resp.status_code)
+        embeddings = resp.output['embeddings']
+        if len(embeddings) != len(inputs):
+            # The request was understood, sending it again returns the same count
+            raise GmeAPIError(f"GME API returned {len(embeddings)} embeddings for {len(inputs)} inputs",
+                              retryable=False)
+        ordered = sorted(embeddings, key=lambda item: item.get('index', 0))
+        return [np.array(item['embedding']) for item in ordered]
+
+    def _call_with_retry(self, inputs: List[Dict[str, str]]) -> List[np.ndarray]:
+        """Call the API, retrying retryable failures with full-jitter exponential backoff"""
+        for attempt in range(self.max_retries):
+            try:
+                return self._call(inputs)
+            except GmeAPIError as e:
+                if not e.retryable or attempt == self.max_retries - 1:
+                    raise
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                logger.warning(f"{str(e)}, retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+
+    def _embed_chunk(self, items: List[tuple]) -> List[Union[np.ndarray, Exception]]:
+        """Embed (text, image_path) items, isolating failures to the items that caused them
+
+        Returns:
+            list: Vector or exception per item
+        """
+        try:
+            return self._call_with_retry([self._input_item(text, image) for text, image in items])
+        except Exception as e:
+            if len(items) == 1:
+                return [e]
+            logger.warning(f"Batch of {len(items)} inputs failed ({str(e)}), embedding them one by one")
+        results = []
+        for item in items:
+            try:
+                results.extend(self._call_with_retry([self._input_item(*item)]))
+            except Exception as e:
+                results.append(e)
+        return results
+
     def get_embedding(self, text: str = None, image_path: str = None) -> np.ndarray:
         """Get multimodal embedding vector for text and image
         
@@ -62,25 +228,7 @@ class GmeAPI:
         Returns:
             np.ndarray: Generated embedding vector
         """
-        # Prepare input data
-        input_data = {'text': text} if text else {}
-        if image_path:
-            input_data['image'] = self._image_to_base64(image_path)
-            
-        inputs = [input_data]
-
-        # Call GME API
-        resp = dashscope.MultiModalEmbedding.call(
-            model="multimodal-embedding-v1",
-            input=inputs
-        )
-        
-        if resp.status_code == HTTPStatus.OK:
-            # Get embedding vector
-            embedding = np.array(resp.output['embeddings'][0]['embedding'])
-            return embedding
-        else:
-            raise Exception(f"GME API call failed: {resp.message}")
+        return self._call_with_retry([self._input_item(text, image_path)])[0]
 
     def get_batch_embeddings(
         self, 
@@ -90,6 +238,12 @@ class GmeAPI:
         show_progress: bool = True
     ) -> np.ndarray:
         """Get batch multimodal embedding vectors
+
+        Inputs are sent up to min(batch_size, max_batch) per request (images
+        up to min(batch_size, max_image_batch)) with
+        max_workers requests in flight. A failing request is retried, then
+        split into single-input requests so one bad input does not fail the
+        others. Successful vectors are cached before an error is raised.
         
         Args:
             texts: List of texts
@@ -104,25 +258,58 @@ class GmeAPI:
             raise ValueError("texts and image_paths cannot be None at the same time")
             
         n = len(texts) if texts is not None else len(image_paths)
-        embeddings = []
-        
-        iterator = range(0, n, batch_size)
-        if show_progress:
-            iterator = tqdm(iterator, desc="Generating embedding vectors", unit="batch")
-            
-        for i in iterator:
-            batch_texts = None if texts is None else texts[i:i+batch_size]
-            batch_images = None if image_paths is None else image_paths[i:i+batch_size]
-            
-            batch_embeddings = []
-            for j in range(min(batch_size, len(batch_texts or batch_images))):
-                text = batch_texts[j] if batch_texts else None
-                image = batch_images[j] if batch_images else None
-                embedding = self.get_embedding(text, image)
-                batch_embeddings.append(embedding)
-                
-            embeddings.extend(batch_embeddings)
-            
+        embeddings = [None] * n
+
+        # Look up cached vectors by content, only the rest is sent to the API
+        keys = None
+        if self.cache is not None:
+            keys = [
+                self.cache.make_key(self.cache_namespace,
+                                    None if texts is None else texts[i],
+                                    None if image_paths is None else image_paths[i])
+                for i in range(n)
+            ]
+            cached = self.cache.get_many(keys)
+            for i, key in enumerate(keys):
+                embeddings[i] = cached.get(key)
+        missing = [i for i in range(n) if embeddings[i] is None]
+        if keys is not None:
+            logger.info(f"Embedding cache: {n - len(missing)} hits, {len(missing)} misses")
+
+        # A text and an image of the same item are embedded together in their own request
+        if texts is not None and image_paths is not None:
+            per_request = 1
+        else:
+            per_request = max(1, min(batch_size, self.max_batch if image_paths is None else self.max_image_batch))
+        chunks = [missing[start:start + per_request] for start in range(0, len(missing), per_request)]
+
+        computed = {}
+        errors = {}
+        pbar = tqdm(total=len(chunks), disable=not show_progress, desc="Generating embedding vectors", unit="batch")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self._embed_chunk, [
+                    (texts[i] if texts else None, image_paths[i] if image_paths else None) for i in chunk
+                ]): chunk
+                for chunk in chunks
+            }
+            for future in as_completed(futures):
+                for i, result in zip(futures[future], future.result()):
+                    if isinstance(result, Exception):
+                        errors[i] = result
+                    else:
+                        embeddings[i] = result
+                        if keys is not None:
+                            computed[keys[i]] = result
+                pbar.update(1)
+        pbar.close()
+
+        if computed:
+            self.cache.put_many(computed)
+        if errors:
+            first = min(errors)
+            raise GmeAPIError(f"Failed to embed {len(errors)} of {len(missing)} inputs, "
+                              f"first failure at index {first}: {str(errors[first])}")
         return np.array(embeddings)
 
     def get_text_embeddings(
@@ -172,8 +359,22 @@ class GmeAPI:
         )
 
 
+DTYPES = {'float32': torch.float32, 'bfloat16': torch.bfloat16, 'float16': torch.float16}
+
+# Tokens of the chat template around every input
+PROMPT_OVERHEAD_TOKENS = 32
+# Rough characters per text token, only used to order and pack batches
+CHARS_PER_TOKEN = 4
+
+
 class GmeQwen2VL:
-    """GME Model Wrapper Class"""
+    """GME Model Wrapper Class
+
+    On CPU the model runs in float32 by default (float16 matmuls are slow or
+    unsupported there). bfloat16, dynamic int8 quantization of the language
+    model's Linear layers, the intra-op thread count and torch.compile can be
+    selected to trade accuracy for throughput.
+    """
     def __init__(
         self,
         model_name: str = "Alibaba-NLP/gme-Qwen2-VL-2B-Instruct",
@@ -182,17 +383,66 @@ class GmeQwen2VL:
         min_image_tokens=256,
         max_image_tokens=1280,
         max_length=1800,
+        cache: Optional[EmbeddingCache] = None,
+        max_batch_tokens: int = 16384,
+        prefetch_workers: int = 2,
+        prefetch_batches: int = 2,
+        prefetch_processes: bool = False,
+        dtype: Optional[str] = None,
+        quantize: bool = False,
+        num_threads: Optional[int] = None,
+        compile_model: bool = False,
         **kwargs,
     ) -> None:
+        """Load model and processor
+
+        Args:
+            max_batch_tokens: Budget of padded tokens per batch; inputs are batched
+                by estimated length so little compute is spent on padding
+            prefetch_workers: Threads decoding and resizing images ahead of the
+                model, 0 prepares images inline
+            prefetch_batches: Image batches prepared ahead of the model
+            prefetch_processes: Prefetch on worker processes (started with
+                forkserver or spawn) instead of threads
+            dtype: 'float32', 'bfloat16' or 'float16'; float16 on CUDA and float32 on CPU by default
+            quantize: Apply dynamic int8 quantization to the language model's Linear
+                layers, CPU and float32 only
+            num_threads: Intra-op threads of torch, torch's default if None
+            compile_model: Compile the language model with torch.compile
+        """
         model_name = model_path or model_name
+        self.model_name = model_name
+        self.cache = cache
+        dtype = dtype or ('float16' if device.startswith('cuda') else 'float32')
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype: {dtype}, expected one of {list(DTYPES)}")
+        if quantize and (dtype != 'float32' or not device.startswith('cpu')):
+            raise ValueError("Dynamic int8 quantization requires dtype='float32' on CPU")
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        # Embeddings of different profiles drift apart, the embedding cache must not mix them
+        self.profile = dtype + (':int8' if quantize else '')
+
         self.base = AutoModelForVision2Seq.from_pretrained(
-            model_name, torch_dtype=torch.float16, **kwargs
+            model_name, torch_dtype=DTYPES[dtype], **kwargs
         )
         self.base.eval()
+        if quantize:
+            # The vision tower is left in float32, it runs once per image
+            self.base.model = torch.quantization.quantize_dynamic(
+                self.base.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        if compile_model:
+            # Sequence lengths vary from batch to batch
+            self.base.model = torch.compile(self.base.model, dynamic=True)
         self.normalize = True
         self.device = device
         min_pixels = min_image_tokens * 28 * 28
         max_pixels = max_image_tokens * 28 * 28
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.max_batch_tokens = max_batch_tokens
+        self.prefetcher = ImagePrefetcher(prefetch_workers, prefetch_batches, prefetch_processes)
         self.max_length = max_length
         self.processor = AutoProcessor.from_pretrained(
             model_name, min_pixels=min_pixels, max_pixels=max_pixels, **kwargs
@@ -200,7 +450,8 @@ class GmeQwen2VL:
         self.processor.tokenizer.padding_side = 'right'
         self.default_instruction = 'You are a helpful assistant.'
         self.sep = ' '
-        logger.info("Successfully initialized GME model")
+        logger.info(f"Successfully initialized GME model ({self.profile} on {device}, "
+                    f"{torch.get_num_threads()} threads{', compiled' if compile_model else ''})")
 
     def forward(
         self,
@@ -247,7 +498,8 @@ class GmeQwen2VL:
             embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
         return embeddings.contiguous()
 
-    def embed(self, texts: list[str], images: list[Image.Image], is_query=True, instruction=None, **kwargs):
+    def embed(self, texts: list[str], images: list[Image.Image], is_query=True, instruction=None,
+              prepared=False, **kwargs):
         self.base.to(self.device)
         input_texts, input_images = list(), list()
         for t, i in zip(texts, images):
@@ -258,7 +510,9 @@ class GmeQwen2VL:
                 input_images = None
             else:
                 input_str += '<|vision_start|><|image_pad|><|vision_end|>'
-                i = self._fetch_image(i)
+                # Prefetched images are already loaded and resized
+                if not prepared:
+                    i = self._fetch_image(i)
                 input_images.append(i)
             if t is not None:
                 input_str += t
@@ -274,35 +528,14 @@ class GmeQwen2VL:
             return_tensors='pt'
         )
         inputs = {k: v.to(self.device) for k, v in inputs.items()}
-        with torch.no_grad():
+        with torch.inference_mode():
             embeddings = self.forward(**inputs)
         return embeddings
 
     def _fetch_image(self, image: Union[str, Image.Image]) -> Image.Image:
         """Load image, supports local path, URL and PIL.Image object"""
         try:
-            if isinstance(image, Image.Image):
-                image_obj = image
-            elif image.startswith(('http://', 'https://')):
-                image_obj = Image.open(requests.get(image, stream=True).raw)
-            elif image.startswith('file://'):
-                image_obj = Image.open(image[7:])
-            elif image.startswith('data:image'):
-                if 'base64,' in image:
-                    _, base64_data = image.split('base64,', 1)
-                    data = base64.b64decode(base64_data)
-                    image_obj = Image.open(BytesIO(data))
-            else:
-                image_obj = Image.open(image)
-
-            if image_obj is None:
-                raise ValueError(f"Unrecognized image input, support local path, http url, base64 and PIL.Image, got {image}")
-
-            image = image_obj.convert('RGB')
-            width, height = image.size
-            resized_height, resized_width = self._smart_resize(height, width)
-            image = image.resize((resized_width, resized_height))
-            return image
+            return fetch_image(image)
         except Exception as e:
             logger.error(f"Error loading image: {str(e)}")
             raise
@@ -317,34 +550,7 @@ class GmeQwen2VL:
         max_ratio: int = 200
     ) -> tuple[int, int]:
         """Smart resize image"""
-        def round_by_factor(number: int, factor: int) -> int:
-            return round(number / factor) * factor
-
-        def ceil_by_factor(number: int, factor: int) -> int:
-            return math.ceil(number / factor) * factor
-
-        def floor_by_factor(number: int, factor: int) -> int:
-            return math.floor(number / factor) * factor
-
-        h_bar = max(factor, round_by_factor(height, factor))
-        w_bar = max(factor, round_by_factor(width, factor))
-        
-        if h_bar * w_bar > max_pixels:
-            beta = math.sqrt((height * width) / max_pixels)
-            h_bar = floor_by_factor(height / beta, factor)
-            w_bar = floor_by_factor(width / beta, factor)
-        elif h_bar * w_bar < min_pixels:
-            beta = math.sqrt(min_pixels / (height * width))
-            h_bar = ceil_by_factor(height * beta, factor)
-            w_bar = ceil_by_factor(width * beta, factor)
-
-        if max(h_bar, w_bar) / min(h_bar, w_bar) > max_ratio:
-            logger.warning(f"Absolute aspect ratio must be smaller than {max_ratio}, got {max(h_bar, w_bar) / min(h_bar, w_bar)}")
-            if h_bar > w_bar:
-                h_bar = w_bar * max_ratio
-            else:
-                w_bar = h_bar * max_ratio
-        return h_bar, w_bar
+        return smart_resize(height, width, factor, min_pixels, max_pixels, max_ratio)
 
     def get_text_embeddings(self, texts: List[str], instruction: Optional[str] = None, **kwargs) -> torch.Tensor:
         """Get text embeddings"""
@@ -362,29 +568,143 @@ class GmeQwen2VL:
         show_progress_bar: bool = True,
         **kwargs
     ) -> torch.Tensor:
-        """Get fused modal embeddings"""
-        if isinstance(images, DataLoader):
-            image_loader = images
-            batch_size = image_loader.batch_size
-            image_loader.dataset.transform = None
-        else:
-            if images is None:
-                image_loader = None
+        """Get fused modal embeddings, computing only inputs missing from the cache"""
+        if self.cache is None or isinstance(images, DataLoader):
+            return self._compute_fused_embeddings(texts, images, batch_size, show_progress_bar, **kwargs)
+
+        n = len(texts) if texts is not None else len(images)
+        # The instruction only applies to queries, see embed
+        is_query = kwargs.get('is_query', True)
+        instruction = kwargs.get('instruction')
+        if not is_query or instruction is None:
+            instruction = self.default_instruction
+        namespace = f"gme_qwen2vl:{self.model_name}:{self.profile}:{self.max_length}:{is_query}:{instruction}"
+        keys = [
+            self.cache.make_key(namespace,
+                                None if texts is None else texts[i],
+                                None if images is None else images[i])
+            for i in range(n)
+        ]
+        cached = self.cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        logger.info(f"Embedding cache: {n - len(missing)} hits, {len(missing)} misses")
+
+        if missing:
+            computed = self._compute_fused_embeddings(
+                None if texts is None else [texts[i] for i in missing],
+                None if images is None else [images[i] for i in missing],
+                batch_size, show_progress_bar, **kwargs
+            ).float().numpy()
+            new_vectors = {keys[i]: vector for i, vector in zip(missing, computed)}
+            self.cache.put_many(new_vectors)
+            cached.update(new_vectors)
+        return torch.from_numpy(np.stack([np.asarray(cached[key], dtype=np.float32) for key in keys]))
+
+    def _image_size(self, image: Union[str, Image.Image]) -> Optional[tuple]:
+        """(width, height) of an image from its header, None if it cannot be read cheaply"""
+        if isinstance(image, Image.Image):
+            return image.size
+        if image.startswith(('http://', 'https://', 'data:')):
+            return None
+        path = image[7:] if image.startswith('file://') else image
+        try:
+            with Image.open(path) as image_obj:
+                return image_obj.size
+        except OSError:
+            return None
+
+    def _estimate_tokens(self, texts: Optional[List[str]], images: Optional[List[Union[str, Image.Image]]]) -> List[int]:
+        """Estimate the sequence length of every input
+
+        Image tokens follow the grid the processor resizes images to: one token
+        per 28x28 patch of the image resized between min_pixels and max_pixels.
+        """
+        n = len(texts) if texts is not None else len(images)
+        estimates = []
+        for i in range(n):
+            tokens = PROMPT_OVERHEAD_TOKENS
+            if texts is not None and texts[i] is not None:
+                tokens += len(texts[i]) // CHARS_PER_TOKEN + 1
+            if images is not None and images[i] is not None:
+                size = self._image_size(images[i])
+                if size is None:
+                    tokens += self.max_pixels // (28 * 28)
+                else:
+                    height, width = self._smart_resize(size[1], size[0], min_pixels=self.min_pixels,
+                                                       max_pixels=self.max_pixels)
+                    tokens += (height // 28) * (width // 28)
+            estimates.append(min(tokens, self.max_length))
+        return estimates
+
+    @staticmethod
+    def _schedule_batches(token_counts: List[int], batch_size: int, max_batch_tokens: int) -> List[List[int]]:
+        """Group input indices into batches of similar length under a padded token budget
+
+        Inputs are sorted longest first, so each batch is padded to its first
+        input and long inputs (the likeliest to run out of memory) come first.
+        A single input over the budget gets a batch of its own.
+        """
+        order = sorted(range(len(token_counts)), key=lambda i: token_counts[i], reverse=True)
+        batches = []
+        for i in order:
+            batch = batches[-1] if batches else None
+            if (batch is None or len(batch) >= batch_size
+                    or token_counts[batch[0]] * (len(batch) + 1) > max_batch_tokens):
+                batches.append([i])
             else:
-                image_loader = DataLoader(
-                    images,
-                    batch_size=batch_size,
-                    shuffle=False,
-                    collate_fn=custom_collate_fn,
-                    num_workers=0,  # Disable multi-process on Windows
-                )
-
-        if texts is None:
-            assert image_loader is not None
-            n_batch = len(image_loader)
+                batch.append(i)
+        return batches
+
+    def _compute_fused_embeddings(
+        self,
+        texts: Optional[List[str]] = None,
+        images: Optional[List[Union[str, Image.Image]]] = None,
+        batch_size: int = 32,
+        show_progress_bar: bool = True,
+        max_batch_tokens: Optional[int] = None,
+        **kwargs
+    ) -> torch.Tensor:
+        """Run the model over all inputs
+
+        Inputs are batched by estimated token count under max_batch_tokens (and
+        at most batch_size per batch); embeddings are returned in input order.
+        """
+        if isinstance(images, DataLoader):
+            return self._compute_loader_embeddings(texts, images, show_progress_bar, **kwargs)
+
+        token_counts = self._estimate_tokens(texts, images)
+        if not token_counts:
+            return torch.empty(0)
+        batches = self._schedule_batches(token_counts, batch_size, max_batch_tokens or self.max_batch_tokens)
+
+        # Images of the next batches are decoded and resized while the model runs
+        if images is None:
+            image_batches = ([None] * len(batch) for batch in batches)
         else:
-            n_batch = len(texts) // batch_size + int(len(texts) % batch_size > 0)
-            image_loader = image_loader or [None] * n_batch
+            image_batches = self.prefetcher.iterate([[images[i] for i in batch] for batch in batches])
+
+        all_embeddings = [None] * len(token_counts)
+        pbar = tqdm(total=len(batches), disable=not show_progress_bar, mininterval=1, miniters=10, desc='encode')
+        for batch, img_batch in zip(batches, image_batches):
+            text_batch = [None] * len(batch) if texts is None else [texts[i] for i in batch]
+            embeddings = self.embed(texts=text_batch, images=img_batch, prepared=True, **kwargs).cpu()
+            for i, embedding in zip(batch, embeddings):
+                all_embeddings[i] = embedding
+            pbar.update(1)
+        pbar.close()
+        return torch.stack(all_embeddings)
+
+    def _compute_loader_embeddings(
+        self,
+        texts: Optional[List[str]],
+        image_loader: DataLoader,
+        show_progress_bar: bool = True,
+        **kwargs
+    ) -> torch.Tensor:
+        """Run the model over the batches of a caller-provided DataLoader in order"""
+        batch_size = image_loader.batch_size
+        image_loader.dataset.transform = None
+        n_batch = len(image_loader)
 
         all_embeddings = list()
         none_batch = [None] * batch_size
@@ -392,11 +712,14 @@ class GmeQwen2VL:
         
         for n, img_batch in zip(range(0, n_batch * batch_size, batch_size), image_loader):
             text_batch = none_batch if texts is None else texts[n: n+batch_size]
-            img_batch = none_batch if img_batch is None else img_batch
             embeddings = self.embed(texts=text_batch, images=img_batch, **kwargs)
             pbar.update(1)
             all_embeddings.append(embeddings.cpu())
             
         pbar.close()
         all_embeddings = torch.cat(all_embeddings, dim=0)
-        return all_embeddings 
\ No newline at end of file
+        return all_embeddings
+
+    def close(self) -> None:
+        """Shut down the image prefetch workers"""
+        self.prefetcher.close()
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import math
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import openai
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+# Rough per-image cost used when the real image size is unknown
+DEFAULT_IMAGE_TOKENS = 765
+# Approximate number of characters per text token
+CHARS_PER_TOKEN = 4
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Estimate vision tokens of an image following the OpenAI tiling scheme
+
+    Args:
+        width: Image width in pixels
+        height: Image height in pixels
+        detail: Image detail level ('low' or 'high')
+
+    Returns:
+        int: Estimated number of prompt tokens
+    """
+    if detail == "low":
+        return 85
+    # Fit into 2048x2048, then scale the shortest side down to 768
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def estimate_message_tokens(messages: List[Dict[str, Any]],
+                            image_sizes: Optional[Sequence[Tuple[int, int]]] = None) -> int:
+    """Estimate prompt tokens of chat messages
+
+    Args:
+        messages: Chat messages
+        image_sizes: Width and height of every image part in message order,
+            images without a known size are charged DEFAULT_IMAGE_TOKENS
+    """
+    image_sizes = list(image_sizes or [])
+    images = 0
+    tokens = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += len(content) // CHARS_PER_TOKEN + 4
+            continue
+        for part in content:
+            if part.get("type") == "text":
+                tokens += len(part["text"]) // CHARS_PER_TOKEN
+            elif part.get("type") == "image_url":
+                if images < len(image_sizes):
+                    detail = part["image_url"].get("detail", "auto")
+                    tokens += estimate_image_tokens(*image_sizes[images], detail=detail)
+                else:
+                    tokens += DEFAULT_IMAGE_TOKENS
+                images += 1
+        tokens += 4
+    return tokens
+
+
+class TokenBucket:
+    """Asyncio token bucket refilled continuously at a per-minute rate"""
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1) -> None:
+        """Wait until amount tokens are available and take them"""
+        # Requests larger than the bucket would never fit, so cap them
+        amount = min(float(amount), self.capacity)
+        # Holding the lock while sleeping keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read the server-requested delay from Retry-After headers, if any"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+class AsyncLLMClient:
+    """Asyncio chat completion client with concurrency cap, rate limiting and backoff
+
+    The client owns an event loop running on a background thread, so one
+    instance (and its connection pool) can be shared by several processors
+    and called from synchronous code through `complete`.
+    """
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str,
+        timeout: float = 30,
+        max_concurrency: int = 8,
+        requests_per_minute: int = 500,
+        tokens_per_minute: int = 30000,
+        max_retries: int = 3,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+    ):
+        """Initialize client
+
+        Args:
+            api_key: OpenAI compatible API key
+            base_url: API base URL
+            timeout: Request timeout in seconds
+            max_concurrency: Maximum number of requests in flight
+            requests_per_minute: Request rate limit
+            tokens_per_minute: Estimated prompt token rate limit
+            max_retries: Attempts per request, including the first one
+            backoff_base: Base delay of the exponential backoff in seconds
+            backoff_max: Maximum backoff delay in seconds
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True)
+        self._thread.start()
+
+        # Retries are handled here so that they go through the rate limiter
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+        # Create asyncio primitives on the client loop they will be used from
+        self.submit(self._init_limits(max_concurrency, requests_per_minute, tokens_per_minute)).result()
+
+    async def _init_limits(self, max_concurrency: int, requests_per_minute: int, tokens_per_minute: int) -> None:
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._request_bucket = TokenBucket(requests_per_minute)
+        self._token_bucket = TokenBucket(tokens_per_minute)
+
+    def _backoff_delay(self, attempt: int, error: Exception) -> float:
+        """Exponential backoff with full jitter, never shorter than Retry-After"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    async def acomplete(self, messages: List[Dict[str, Any]], model: str = "gpt-4o",
+                        image_sizes: Optional[Sequence[Tuple[int, int]]] = None) -> str:
+        """Run a chat completion and return the message content
+
+        Args:
+            messages: Chat messages
+            model: Model name
+            image_sizes: Sizes of the image parts, used to estimate prompt tokens
+        """
+        estimated_tokens = estimate_message_tokens(messages, image_sizes)
+        for attempt in range(self.max_retries):
+            await self._request_bucket.acquire(1)
+            await self._token_bucket.acquire(estimated_tokens)
+            try:
+                async with self._semaphore:
+                    chat_completion = await self.client.chat.completions.create(
+                        messages=messages,
+                        model=model,
+                    )
+                return chat_completion.choices[0].message.content
+            except Exception as e:
+                if attempt == self.max_retries - 1 or not _is_retryable(e):
+                    logger.error(f"Error calling {model} after {attempt + 1} attempts: {str(e)}")
+                    raise
+                delay = self._backoff_delay(attempt, e)
+                logger.warning(f"Attempt {attempt + 1} failed ({str(e)}), retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+
+    def submit(self, coro) -> "asyncio.Future":
+        """Schedule a coroutine on the client loop from any thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def complete(self, messages: List[Dict[str, Any]], model: str = "gpt-4o",
+                 image_sizes: Optional[Sequence[Tuple[int, int]]] = None) -> str:
+        """Blocking wrapper around `acomplete` for synchronous callers"""
+        return self.submit(self.acomplete(messages, model, image_sizes)).result()
+
+    def close(self) -> None:
+        """Close the connection pool and stop the event loop"""
+        if not self._loop.is_running():
+            return
+        self.submit(self.client.close()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
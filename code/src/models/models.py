@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
 
 @dataclass
 class FunctionSegment:
@@ -15,4 +15,11 @@ class RAGResult:
     """RAG search result data class"""
     segment: FunctionSegment
     similarity_score: float
-    match_type: str  # 'text', 'image', or 'both' 
\ No newline at end of file
+    match_type: str  # 'text', 'image', or 'both'
+    frame_index: Optional[int] = None  # Offset of the best matching screenshot for image matches
+
+@dataclass
+class RAGQuery:
+    """RAG search query data class, at least one of text and image is set"""
+    text: Optional[str] = None
+    image: Optional[str] = None
@@ -1,34 +1,109 @@
 import json
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from pathlib import Path
 import logging
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+import hashlib
 import os
 import base64
-from PIL import Image, ImageDraw, ImageFont
 
 from src.config.config import ProcessorConfig
-from src.models.models import FunctionSegment, RAGResult
+from src.models.models import FunctionSegment, RAGQuery, RAGResult
 from src.models.gme_model import GmeQwen2VL, GmeAPI
+from src.models.llm_client import AsyncLLMClient, CHARS_PER_TOKEN
 from src.processors.rag_processor import RAGProcessor
+from src.processors.image_processor import WindowImagePreparer
+from src.processors.boundary_detector import UIBoundaryDetector
+from src.processors.window_policy import WindowPolicy
 from src.utils.logger import setup_logger
+from src.utils.response_cache import ResponseCache
+from src.utils.embedding_cache import EmbeddingCache
+
+SUMMARY_INSTRUCTIONS = """Please provide a detailed summary including:
+1. Overall app interface analysis
+2. Main functionalities
+3. Testing recommendations for:
+   - Coverage testing
+   - Bug detection
+   - Edge cases
+   - Critical paths
+
+Format your response as a detailed text analysis.
+"""
 
 class ActionHistoryProcessor:
     """Action History Processor Class"""
-    def __init__(self, config: ProcessorConfig):
+    def __init__(self, config: ProcessorConfig, llm_client: Optional[AsyncLLMClient] = None):
+        """Initialize processor
+
+        Args:
+            config: Processor configuration
+            llm_client: Shared LLM client; a new one is created from config if None
+        """
         self.config = config
         self.logger = setup_logger(__name__, config.log_file, config.output_dir)
         
-        self.client = OpenAI(
+        self.llm_client = llm_client or AsyncLLMClient(
             api_key=config.api_key,
             base_url=config.base_url,
-            timeout=config.timeout
+            timeout=config.timeout,
+            max_concurrency=config.max_concurrency,
+            requests_per_minute=config.requests_per_minute,
+            tokens_per_minute=config.tokens_per_minute,
+            max_retries=config.max_retries,
+            backoff_base=config.backoff_base,
+            backoff_max=config.backoff_max
+        )
+        self.image_preparer = WindowImagePreparer(
+            max_size=config.image_max_size,
+            quality=config.image_quality,
+            max_workers=config.image_workers,
+            cache_max_bytes=config.image_cache_max_bytes
+        )
+        self.boundary_detector = UIBoundaryDetector(config.boundary_similarity_threshold)
+        self.response_cache = ResponseCache(
+            path=config.response_cache_path or str(Path(config.output_dir) / "llm_response_cache.sqlite"),
+            max_bytes=config.response_cache_max_bytes,
+            mode=config.response_cache_mode
+        )
+        self.embedding_cache = EmbeddingCache(
+            path=config.embedding_cache_path or str(Path(config.output_dir) / "embedding_cache.sqlite"),
+            max_bytes=config.embedding_cache_max_bytes,
+            mode=config.embedding_cache_mode
         )
         
         try:
-            # self.gme_model = GmeQwen2VL(config.model_name)
-            self.gme_model = GmeAPI(config.gme_api_key)
-            self.rag_processor = RAGProcessor(self.gme_model)
+            # self.gme_model = GmeQwen2VL(config.model_name, cache=self.embedding_cache)
+            self.gme_model = GmeAPI(
+                config.gme_api_key,
+                cache=self.embedding_cache,
+                max_batch=config.gme_max_batch,
+                max_image_batch=config.gme_max_image_batch,
+                max_workers=config.gme_max_workers,
+                max_retries=config.max_retries,
+                backoff_base=config.backoff_base,
+                backoff_max=config.backoff_max,
+                upload_format=config.gme_upload_format,
+                upload_quality=config.gme_upload_quality,
+                upload_max_pixels=config.gme_upload_max_pixels
+            )
+            self.rag_processor = RAGProcessor(
+                self.gme_model,
+                near_duplicate_threshold=config.near_duplicate_threshold,
+                index_type=config.rag_index_type,
+                nlist=config.rag_nlist,
+                nprobe=config.rag_nprobe,
+                pq_m=config.rag_pq_m,
+                hnsw_m=config.rag_hnsw_m,
+                ef_search=config.rag_ef_search,
+                fusion=config.rag_fusion,
+                fusion_candidates=config.rag_fusion_candidates,
+                text_weight=config.rag_text_weight,
+                rrf_k=config.rag_rrf_k,
+                query_cache_max_bytes=config.query_cache_max_bytes,
+                query_cache_ttl=config.query_cache_ttl
+            )
             self.logger.info("Successfully initialized processors")
         except Exception as e:
             self.logger.error(f"Failed to initialize processors: {str(e)}")
@@ -39,47 +114,71 @@ class ActionHistoryProcessor:
         with open(image_path, "rb") as image_file:
             return base64.b64encode(image_file.read()).decode("utf-8")
 
-    def _call_gpt4o(self, prompt: str, images: Optional[List[str]] = None) -> str:
-        """Call GPT-4o model with multimodal input support"""
+    def _image_url(self, image: str) -> str:
+        """Return a data URL for an image path or an already prepared data URL"""
+        if image.startswith("data:"):
+            return image
+        return f"data:image/png;base64,{self._encode_image(image)}"
+
+    def _response_cache_key(self, prompt: str, images: Optional[List[str]] = None) -> str:
+        """Cache key of a request: model name, prompt text and image contents"""
+        image_urls = [self._image_url(image) for image in images or []]
+        return ResponseCache.make_key(self.config.llm_model, prompt, image_urls)
+
+    def _call_gpt4o(self, prompt: str, images: Optional[List[str]] = None,
+                    single_message: bool = False,
+                    image_sizes: Optional[List[Tuple[int, int]]] = None) -> str:
+        """Call GPT-4o model with multimodal input support
+
+        Responses are served from and stored in the persistent response cache.
+
+        Args:
+            prompt: Text prompt
+            images: Image paths or base64 data URLs
+            single_message: Send prompt and images as one multi-part message
+                instead of one message per image
+            image_sizes: Width and height of every image, used to estimate
+                prompt tokens for rate limiting
+        """
+        image_urls = [self._image_url(image) for image in images or []]
+        cache_key = ResponseCache.make_key(self.config.llm_model, prompt, image_urls)
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        if single_message:
+            content = [{"type": "text", "text": prompt}]
+            content.extend({"type": "image_url", "image_url": {"url": url}} for url in image_urls)
+            response = self.llm_client.complete([{"role": "user", "content": content}],
+                                                model=self.config.llm_model, image_sizes=image_sizes)
+            self.response_cache.put(cache_key, response)
+            return response
+
         messages = []
         
         # If there are image inputs, add image messages first
-        if images:
-            for image_path in images:
-                base64_image = self._encode_image(image_path)
-                messages.append({
-                    "role": "user", 
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
-                            }
+        for image_url in image_urls:
+            messages.append({
+                "role": "user", 
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url
                         }
-                    ]
-                })
+                    }
+                ]
+            })
         
         messages.append({
             "role": "user",
             "content": prompt
         })
 
-        # print(messages)
-        # print(prompt)
-        
-        for attempt in range(self.config.max_retries):
-            try:
-                chat_completion = self.client.chat.completions.create(
-                    messages=messages,
-                    model="gpt-4o",
-                )
-                # print(chat_completion)
-                return chat_completion.choices[0].message.content
-            except Exception as e:
-                if attempt == self.config.max_retries - 1:
-                    self.logger.error(f"Error calling GPT-4o after {self.config.max_retries} attempts: {str(e)}")
-                    raise
-                self.logger.warning(f"Attempt {attempt + 1} failed, retrying...")
+        # Retries, backoff and rate limiting are handled by the shared client
+        response = self.llm_client.complete(messages, model=self.config.llm_model, image_sizes=image_sizes)
+        self.response_cache.put(cache_key, response)
+        return response
 
     def _extract_json_from_response(self, response: str) -> dict:
         """Extract JSON from response"""
@@ -94,122 +193,439 @@ class ActionHistoryProcessor:
             self.logger.error(f"Failed to parse JSON from response: {str(e)}")
             raise
 
-    def _compress_image(self, image: Image.Image, quality: int = 60, max_size: tuple = (800, 800)) -> Image.Image:
-        """Compress image quality and size
-        
+    @staticmethod
+    def _needs_description(segment: FunctionSegment) -> bool:
+        """Whether a segment was cut locally and still waits for its description"""
+        return not segment.func_desc
+
+    def _segment_window(self, window_actions: List[str], window_screenshots: List[str],
+                        current_index: int, end_index: int,
+                        window_ui_trees: Optional[List[str]] = None,
+                        window_policy: Optional[WindowPolicy] = None) -> Tuple[FunctionSegment, int]:
+        """Find where the first function of a window ends
+
+        If UI trees are given, an obvious boundary within the first
+        local_segment_max_actions actions is cut without a segmentation call;
+        the segment is returned without func_desc and action_detail, which
+        `_release_segments` fills in with one text-only call per batch of
+        local cuts. A later boundary narrows the range the model is asked
+        about. The window policy, if given, is updated with the outcome of
+        every LLM-segmented window.
+
+        Returns:
+            Tuple[FunctionSegment, int]: The closed segment and the number of actions it consumed
+        """
+        if window_ui_trees is not None and self.config.local_boundary_detection:
+            boundary = self.boundary_detector.find_boundary(window_ui_trees)
+            if boundary is not None:
+                consumed, reason = boundary
+                if consumed <= self.config.local_segment_max_actions:
+                    self.boundary_detector.local_cuts += 1
+                    self.logger.info(f"Cut segment at index {current_index + consumed} locally: {reason}")
+                    segment = FunctionSegment(
+                        actions=window_actions[:consumed],
+                        screenshots=window_screenshots[:consumed + 1],
+                        func_desc='',
+                        action_detail='',
+                        reasoning=f"Boundary detected locally from the UI hierarchy: {reason}"
+                    )
+                    return segment, consumed
+                if consumed < len(window_actions):
+                    self.boundary_detector.narrowed_windows += 1
+                    self.logger.info(f"Narrowed window to end at index {current_index + consumed}: {reason}")
+                    window_actions = window_actions[:consumed]
+                    window_screenshots = window_screenshots[:consumed + 1]
+                    end_index = current_index + consumed
+
+        # Compress and label window screenshots in memory, dropping near-duplicates
+        packed = self.config.pack_screenshots
+        if packed:
+            window_images = self.image_preparer.prepare_mosaics(
+                window_screenshots,
+                self.config.near_duplicate_threshold,
+                cell_size=self.config.mosaic_cell_size,
+                columns=self.config.mosaic_columns,
+                max_cells=self.config.mosaic_max_cells
+            )
+        else:
+            window_images = self.image_preparer.prepare(
+                window_screenshots, self.config.near_duplicate_threshold
+            )
+        kept = {i for image in window_images for i in image.indices}
+        image_urls = [image.url for image in window_images]
+        omitted = [i for i in range(len(window_screenshots)) if i not in kept]
+
+        prompt = self._build_segmentation_prompt(window_actions, current_index, end_index, omitted, packed)
+
+        image_sizes = [(image.width, image.height) for image in window_images]
+        response = self._call_gpt4o(prompt, image_urls, single_message=packed, image_sizes=image_sizes)
+        try:
+            result = self._extract_json_from_response(response)
+        except Exception:
+            # Do not replay an unusable response from the cache on retry
+            self.response_cache.delete(self._response_cache_key(prompt, image_urls))
+            raise
+        # Always make progress, even if the model returns an out-of-range index
+        consumed = max(1, min(int(result['end_index']), len(window_actions)))
+        segment = FunctionSegment(
+            actions=window_actions[:consumed],
+            screenshots=window_screenshots[:consumed + 1],
+            func_desc=result['func_desc'],
+            action_detail=result['action_detail'],
+            reasoning=result['reasoning']
+        )
+        if window_policy is not None:
+            window_policy.record(window_actions, window_images, consumed)
+        return segment, consumed
+
+    def new_window_policy(self) -> WindowPolicy:
+        """Create a window policy from the processor configuration"""
+        return WindowPolicy(
+            window_size=self.config.window_size,
+            min_size=self.config.min_window_size,
+            max_size=self.config.max_window_size,
+            adaptive=self.config.adaptive_window
+        )
+
+    def _recording_fingerprint(self, actions: List[str], screenshots: List[str]) -> str:
+        """Hash identifying a recording, used to match a journal to its input"""
+        data = json.dumps([actions, screenshots], ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _build_description_prompt(self, segments: List[FunctionSegment],
+                                  segment_ui_trees: List[List[str]]) -> str:
+        """Build the prompt describing locally cut segments from their actions and screen texts"""
+        blocks = []
+        for number, (segment, ui_trees) in enumerate(zip(segments, segment_ui_trees)):
+            actions_str = "".join(f"  {i}: {action}\n" for i, action in enumerate(segment.actions))
+            before = ", ".join(f"'{text}'" for text in self.boundary_detector.screen_texts(ui_trees[0]))
+            after = ", ".join(f"'{text}'" for text in self.boundary_detector.screen_texts(ui_trees[-1]))
+            blocks.append(f"Segment {number}:\nActions:\n{actions_str}"
+                          f"Screen texts before: {before or 'none'}\n"
+                          f"Screen texts after: {after or 'none'}\n"
+                          f"{segment.reasoning}\n")
+        segments_str = "\n".join(blocks)
+        return f"""The following action sequences from an Android app each form one complete function; the UI changed clearly after their last action.
+
+{segments_str}
+Describe every segment. Return your answer in the following JSON format, with one entry per segment in the given order:
+```json
+{{
+    "segments": [
+        {{
+            "func_desc": "Detailed description of the function",
+            "action_detail": "Detailed description of the action of this function"
+        }}
+    ]
+}}
+```
+"""
+
+    def _describe_local_segments(self, segments: List[FunctionSegment],
+                                 segment_ui_trees: List[List[str]]) -> None:
+        """Fill in the descriptions of locally cut segments with one text-only call
+
         Args:
-            image: Original image
-            quality: JPEG compression quality (1-100)
-            max_size: Maximum size (width, height)
+            segments: Locally cut segments, updated in place
+            segment_ui_trees: UI trees of every segment, one more than its actions
         """
-        # Resize image
-        image.thumbnail(max_size, Image.Resampling.LANCZOS)
-        
-        # Create new RGB image (remove alpha channel)
-        if image.mode in ('RGBA', 'LA'):
-            background = Image.new('RGB', image.size, (255, 255, 255))
-            background.paste(image, mask=image.split()[-1])
-            image = background
-        
-        return image
+        prompt = self._build_description_prompt(segments, segment_ui_trees)
+        response = self._call_gpt4o(prompt)
+        self.boundary_detector.description_calls += 1
+        try:
+            descriptions = self._extract_json_from_response(response)['segments']
+            if len(descriptions) != len(segments):
+                raise ValueError(f"Expected {len(segments)} descriptions, got {len(descriptions)}")
+        except Exception:
+            # Do not replay an unusable response from the cache on retry
+            self.response_cache.delete(self._response_cache_key(prompt))
+            raise
+        for segment, description in zip(segments, descriptions):
+            segment.func_desc = description['func_desc']
+            segment.action_detail = description['action_detail']
+
+    def _release_segments(self, buffered: List[tuple], final: bool) -> List[tuple]:
+        """Return the buffered segments that can be committed, in order
+
+        Segments are held back while a local cut among them waits for its
+        description; local cuts are described once local_description_batch
+        of them are waiting, or when final.
+
+        Args:
+            buffered: (segment, ui_trees, ...) entries, the released ones are removed
+            final: Describe waiting local cuts regardless of their number
+        """
+        waiting = [entry for entry in buffered if self._needs_description(entry[0])]
+        if waiting:
+            if not final and len(waiting) < self.config.local_description_batch:
+                return []
+            self._describe_local_segments([entry[0] for entry in waiting], [entry[1] for entry in waiting])
+        released = list(buffered)
+        buffered.clear()
+        return released
+
+    def _load_journal(self, journal_path: Path, fingerprint: str) -> Tuple[List[FunctionSegment], int]:
+        """Load committed segments and the index to resume from
+
+        Returns no progress if the journal is missing or belongs to another recording.
+        A partially written last line is cut off so that appends start on a new line.
+        """
+        segments = []
+        current_index = 0
+        if not journal_path.exists():
+            return segments, current_index
+        complete_bytes = 0
+        with open(journal_path, 'rb') as f:
+            for line_no, line in enumerate(f):
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("missing line end")
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # A crash may leave a partially written last line
+                    self.logger.warning(f"Ignoring truncated journal entry at line {line_no + 1}")
+                    break
+                if line_no == 0:
+                    if record.get('type') != 'header' or record.get('fingerprint') != fingerprint:
+                        self.logger.info(f"Journal {journal_path} belongs to another recording, starting over")
+                        return [], 0
+                else:
+                    segments.append(FunctionSegment(**record['segment']))
+                    current_index = record['next_index']
+                complete_bytes += len(line)
+        if segments and complete_bytes < journal_path.stat().st_size:
+            with open(journal_path, 'r+b') as f:
+                f.truncate(complete_bytes)
+        if segments:
+            self.logger.info(f"Resuming segmentation from index {current_index} with {len(segments)} committed segments")
+        return segments, current_index
+
+    def _append_journal(self, journal_path: Path, record: dict) -> None:
+        """Append a record and make sure it reaches the disk"""
+        with open(journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
 
-    def segment_by_function(self, actions: List[str], screenshots: List[str]) -> List[FunctionSegment]:
-        """Segment history by function"""
+    def segment_by_function(self, actions: List[str], screenshots: List[str],
+                            journal_path: Optional[str] = None,
+                            ui_trees: Optional[List[str]] = None) -> List[FunctionSegment]:
+        """Segment history by function
+
+        Args:
+            actions: Action descriptions
+            screenshots: Screenshot paths, one more than actions
+            journal_path: Optional JSONL journal; every committed segment is
+                appended to it and an interrupted run resumes from its last entry
+            ui_trees: Optional UI hierarchy dumps aligned with screenshots, used
+                to cut obvious boundaries without a segmentation call
+        """
         if len(screenshots) != len(actions) + 1:
             raise ValueError(f"Invalid input: screenshots length ({len(screenshots)}) should be actions length ({len(actions)}) + 1")
+        if ui_trees is not None and len(ui_trees) != len(screenshots):
+            raise ValueError(f"Invalid input: ui_trees length ({len(ui_trees)}) should match screenshots length ({len(screenshots)})")
             
         segments = []
         current_index = 0
+        window_policy = self.new_window_policy()
+        self.boundary_detector.reset_stats()
+        if journal_path is not None:
+            journal_path = Path(journal_path)
+            fingerprint = self._recording_fingerprint(actions, screenshots)
+            segments, current_index = self._load_journal(journal_path, fingerprint)
+            if not segments:
+                journal_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(journal_path, 'w', encoding='utf-8') as f:
+                    f.write(json.dumps({'type': 'header', 'fingerprint': fingerprint}) + '\n')
         
+        # Closed segments waiting for the description of a local cut, as (segment, ui_trees, next_index)
+        buffered = []
         while current_index < len(actions):
             try:
-                end_index = min(current_index + self.config.window_size, len(actions))
-                window_actions = actions[current_index:end_index]
-                window_screenshots = screenshots[current_index:end_index + 1]
-
-                prompt = self._build_segmentation_prompt(window_actions, current_index, end_index)
-                
-                # Process images and save to temporary files
-                temp_image_paths = []
-                for i, screenshot in enumerate(window_screenshots):
-                    # Open original image
-                    image = Image.open(screenshot)
-                    # Compress image
-                    compressed_image = self._compress_image(image)
-                    # Create a new image copy
-                    marked_image = compressed_image.copy()
-                    draw = ImageDraw.Draw(marked_image)
-                    
-                    # Use larger font and more prominent color
-                    font = ImageFont.truetype("arial.ttf", 48)  # Increase font size
-                    # Add white background box
-                    text_bbox = draw.textbbox((20, 20), str(i), font=font)
-                    draw.rectangle([text_bbox[0]-20, text_bbox[1]-20, text_bbox[2]+20, text_bbox[3]+20],  # Increase background box margin
-                                 fill='white')
-                    # Draw large text in red
-                    draw.text((20, 20), str(i), font=font, fill='red')
-                    
-                    # Save marked image to temporary file
-                    os.makedirs("tmp/", exist_ok=True)
-                    temp_path = f"tmp/temp_screenshot_{i}.png"
-                    marked_image.save(temp_path, 'JPEG', quality=60, optimize=True)
-                    temp_image_paths.append(temp_path)
-                    
-                    # Verify if image was saved correctly
-                    saved_image = Image.open(temp_path)
-                    if saved_image.getbbox() != marked_image.getbbox():
-                        self.logger.warning(f"Image {i} may not have been saved correctly")
-
-                response = self._call_gpt4o(prompt, temp_image_paths)
-                result = self._extract_json_from_response(response)
-                segment = FunctionSegment(
-                    actions=window_actions[:result['end_index']],
-                    screenshots=window_screenshots[:result['end_index'] + 1],
-                    func_desc=result['func_desc'],
-                    action_detail=result['action_detail'],
-                    reasoning=result['reasoning']
+                end_index = min(current_index + window_policy.size, len(actions))
+                segment, consumed = self._segment_window(
+                    actions[current_index:end_index],
+                    screenshots[current_index:end_index + 1],
+                    current_index,
+                    end_index,
+                    None if ui_trees is None else ui_trees[current_index:end_index + 1],
+                    window_policy
                 )
-                segments.append(segment)
-                
-                current_index += result['end_index']
-                self.logger.info(f"Successfully processed segment {len(segments)}")
-                
-                # Clean up temporary files
-                for temp_path in temp_image_paths:
-                    try:
-                        os.remove(temp_path)
-                    except Exception as e:
-                        self.logger.warning(f"Failed to remove temporary file {temp_path}: {str(e)}")
+                segment_ui_trees = None if ui_trees is None else ui_trees[current_index:current_index + consumed + 1]
+                current_index += consumed
+                buffered.append((segment, segment_ui_trees, current_index))
+
+                for segment, _, next_index in self._release_segments(buffered, current_index >= len(actions)):
+                    segments.append(segment)
+                    if journal_path is not None:
+                        self._append_journal(journal_path, {
+                            'type': 'segment',
+                            'segment': asdict(segment),
+                            'next_index': next_index
+                        })
+                    self.logger.info(f"Successfully processed segment {len(segments)}")
                 
             except Exception as e:
                 self.logger.error(f"Error processing segment at index {current_index}: {str(e)}")
                 raise
                 
+        self.logger.info(f"Window policy stats: {window_policy.stats()}")
+        self.logger.info(f"Window image cache stats: {self.image_preparer.cache.stats()}")
+        self.logger.info(f"Response cache stats: {self.response_cache.stats()}")
+        if ui_trees is not None:
+            self.logger.info(f"Local boundary detection stats: {self.boundary_detector.stats()}")
         return segments
 
     def summarize_functions(self, segments: List[FunctionSegment]) -> str:
-        """Summarize all functions"""
-        # print("summarize all functions")
+        """Summarize all functions
+
+        Prompts over summary_token_budget are summarized hierarchically: segments
+        are split into chunks under the budget and summarized concurrently, then
+        partial summaries are merged level by level until the final reduce fits.
+        """
         prompt = self._build_summary_prompt(segments)
-        # print("prompt:")
-        # print(prompt)
-        response = self._call_gpt4o(prompt)
-        # print("response:")
-        # print(response)
-        return response
+        if self._estimate_tokens(prompt) <= self.config.summary_token_budget:
+            return self._call_gpt4o(prompt)
+
+        segment_texts = [json.dumps(info, ensure_ascii=False) for info in self._segments_info(segments)]
+        chunks = self._chunk_by_tokens(segment_texts)
+        self.logger.info(f"Summarizing {len(segments)} segments in {len(chunks)} chunks")
+        partials = self._call_gpt4o_many([
+            self._build_chunk_summary_prompt(chunk, i, len(chunks)) for i, chunk in enumerate(chunks)
+        ])
+
+        depth = 1
+        while len(partials) > 1 and self._estimate_tokens(self._build_reduce_prompt(partials)) > self.config.summary_token_budget:
+            groups = self._chunk_by_tokens(partials, min_items=2)
+            self.logger.info(f"Merging {len(partials)} partial summaries into {len(groups)} at depth {depth}")
+            partials = self._call_gpt4o_many([self._build_merge_prompt(group) for group in groups])
+            depth += 1
+        return self._call_gpt4o(self._build_reduce_prompt(partials))
+
+    @staticmethod
+    def _segment_identity(segment: FunctionSegment) -> str:
+        """Serialization of all segment fields, used to deduplicate stored segments"""
+        return json.dumps(asdict(segment), ensure_ascii=False, sort_keys=True)
+
+    def _segment_hash(self, segment: FunctionSegment) -> str:
+        """Hash of the segment fields that enter the summary, only used for drift bookkeeping"""
+        data = json.dumps(self._segments_info([segment])[0], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def update_summary(self, segments: List[FunctionSegment], output_file: str) -> str:
+        """Refresh the summary in output_file, merging only new or changed segments
+
+        The hashes of summarized segments are kept in summary_state.json next to
+        output_file. New and changed segments are merged into the previous summary
+        with one call; once the changes accumulated since the last full rebuild
+        exceed summary_drift_threshold of the summarized segments, the summary is
+        rebuilt from all segments.
+
+        Returns:
+            str: The updated summary
+        """
+        output_file = Path(output_file)
+        state_file = output_file.parent / 'summary_state.json'
+        hashes = [self._segment_hash(segment) for segment in segments]
+
+        state = None
+        if state_file.exists() and output_file.exists():
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            with open(output_file, 'r', encoding='utf-8') as f:
+                previous_summary = f.read()
+
+        if state is None:
+            mode = 'rebuild'
+        else:
+            summarized = set(state['segment_hashes'])
+            new_segments = [segment for segment, h in zip(segments, hashes) if h not in summarized]
+            removed = len(summarized - set(hashes))
+            changes = len(new_segments) + removed
+            drift = (state['changes_since_rebuild'] + changes) / max(1, state['rebuild_size'])
+            if changes == 0:
+                self.logger.info("Summary is up to date")
+                return previous_summary
+            mode = 'rebuild' if drift > self.config.summary_drift_threshold else 'merge'
+            self.logger.info(f"{len(new_segments)} new and {removed} removed segments, drift {drift:.2f}: {mode}")
+
+        if mode == 'merge':
+            prompt = self._build_merge_summary_prompt(previous_summary, new_segments, removed)
+            if self._estimate_tokens(prompt) > self.config.summary_token_budget:
+                mode = 'rebuild'
+        if mode == 'merge':
+            summary = self._call_gpt4o(prompt)
+            state = {
+                'segment_hashes': hashes,
+                'rebuild_size': state['rebuild_size'],
+                'changes_since_rebuild': state['changes_since_rebuild'] + changes
+            }
+        else:
+            summary = self.summarize_functions(segments)
+            state = {'segment_hashes': hashes, 'rebuild_size': len(segments), 'changes_since_rebuild': 0}
+        self._write_summary(output_file, summary, state)
+        return summary
+
+    def _write_summary(self, output_file: Path, summary: str, state: dict) -> None:
+        """Write the summary and the state describing which segments it covers"""
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(summary)
+        with open(output_file.parent / 'summary_state.json', 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+
+    def _estimate_tokens(self, text: str) -> int:
+        return len(text) // CHARS_PER_TOKEN
+
+    def _chunk_by_tokens(self, texts: List[str], min_items: int = 1) -> List[List[str]]:
+        """Greedily group texts into chunks whose total stays under the summary budget
+
+        A chunk always holds at least min_items texts, so that merging makes progress
+        even when single texts are close to the budget.
+        """
+        # Leave room for the instructions around the chunk
+        budget = self.config.summary_token_budget * 3 // 4
+        chunks, current, current_tokens = [], [], 0
+        for text in texts:
+            tokens = self._estimate_tokens(text)
+            if current and len(current) >= min_items and current_tokens + tokens > budget:
+                chunks.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            if len(current) < min_items and chunks:
+                chunks[-1].extend(current)
+            else:
+                chunks.append(current)
+        return chunks
+
+    def _call_gpt4o_many(self, prompts: List[str]) -> List[str]:
+        """Run text-only calls concurrently, preserving order"""
+        with ThreadPoolExecutor(max_workers=max(1, min(len(prompts), self.config.max_concurrency))) as executor:
+            return list(executor.map(self._call_gpt4o, prompts))
 
-    def _build_segmentation_prompt(self, actions: List[str], current_index: int, end_index: int) -> str:
+    def _build_segmentation_prompt(self, actions: List[str], current_index: int, end_index: int,
+                                   omitted_screenshots: Optional[List[int]] = None,
+                                   packed: bool = False) -> str:
         """Build function segmentation prompt"""
         # enumerate from current_index to end_index
         actions_str = ""
         for i in range(end_index - current_index):
             actions_str += f"{i + current_index}: {actions[i]}\n"
+        omitted_str = ""
+        if omitted_screenshots:
+            omitted_str = (f"Screenshots {', '.join(map(str, omitted_screenshots))} are omitted because they are "
+                           f"nearly identical to the preceding screenshot.\n")
+        packed_str = ""
+        if packed:
+            packed_str = ("Screenshots are tiled into grid images in index order, "
+                          "left to right and top to bottom.\n")
         return f"""Please analyze the following sequence of actions and screenshots from an Android app.
 Actions: 
 {actions_str}
 
 The screenshot index is displayed in the upper left corner of the screenshot.
-
+{packed_str}{omitted_str}
 Please identify where a logical function or small task ends in this sequence.
 Return your analysis in the following JSON format:
 ```json
@@ -228,32 +644,73 @@ Consider:
 4. App flow
 """
 
-    def _build_summary_prompt(self, segments: List[FunctionSegment]) -> str:
-        """Build function summary prompt"""
+    def _segments_info(self, segments: List[FunctionSegment]) -> List[dict]:
+        """Segment fields used for summarization"""
         segments_info = []
         for segment in segments:
             segments_info.append({
                 "func_desc": segment.func_desc,
                 "action_detail": segment.action_detail
             })
+        return segments_info
+
+    def _build_summary_prompt(self, segments: List[FunctionSegment]) -> str:
+        """Build function summary prompt"""
+        segments_info = self._segments_info(segments)
             
         return f"""Please analyze the following function segments from an Android app and provide a comprehensive summary.
 Function segments: {json.dumps(segments_info, ensure_ascii=False)}
 
-Please provide a detailed summary including:
-1. Overall app interface analysis
-2. Main functionalities
-3. Testing recommendations for:
-   - Coverage testing
-   - Bug detection
-   - Edge cases
-   - Critical paths
+{SUMMARY_INSTRUCTIONS}"""
 
-Format your response as a detailed text analysis.
+    def _build_chunk_summary_prompt(self, segment_texts: List[str], chunk_index: int, num_chunks: int) -> str:
+        """Build the map prompt for one chunk of function segments"""
+        return f"""Please analyze the following function segments from an Android app.
+They are part {chunk_index + 1} of {num_chunks} of the app's recorded functions.
+Function segments: [{", ".join(segment_texts)}]
+
+Summarize the interface, the functionalities and any observations relevant for testing
+(coverage, bugs, edge cases, critical paths). Be concise but keep every distinct functionality.
+"""
+
+    def _build_merge_prompt(self, partial_summaries: List[str]) -> str:
+        """Build the prompt merging partial summaries into one partial summary"""
+        parts = "\n\n".join(f"Partial analysis {i + 1}:\n{text}" for i, text in enumerate(partial_summaries))
+        return f"""The following are partial analyses of different function segments of one Android app.
+{parts}
+
+Merge them into a single concise partial analysis. Remove duplicates but keep every distinct
+functionality and testing-relevant observation.
 """
 
+    def _build_merge_summary_prompt(self, previous_summary: str, new_segments: List[FunctionSegment],
+                                    removed_count: int) -> str:
+        """Build the prompt merging new segments into an existing summary"""
+        removed_str = ""
+        if removed_count:
+            removed_str = (f"\n{removed_count} previously summarized segments were removed or changed; "
+                           f"drop statements that only they supported.\n")
+        return f"""The following is an existing analysis of an Android app:
+{previous_summary}
+
+New function segments were recorded for this app:
+Function segments: {json.dumps(self._segments_info(new_segments), ensure_ascii=False)}
+{removed_str}
+Please update the analysis with the new segments, keeping its structure.
+{SUMMARY_INSTRUCTIONS}"""
+
+    def _build_reduce_prompt(self, partial_summaries: List[str]) -> str:
+        """Build the final prompt turning partial summaries into the app summary"""
+        parts = "\n\n".join(f"Partial analysis {i + 1}:\n{text}" for i, text in enumerate(partial_summaries))
+        return f"""The following are partial analyses of the function segments of an Android app.
+{parts}
+
+Please combine them into a comprehensive summary of the app.
+{SUMMARY_INSTRUCTIONS}"""
+
     def process_and_save(self, actions: List[str], screenshots: List[str], 
-                        output_file: Optional[str] = None) -> None:
+                        output_file: Optional[str] = None,
+                        ui_trees: Optional[List[str]] = None) -> None:
         """Process history and save results"""
         try:
             if output_file is None:
@@ -261,12 +718,27 @@ Format your response as a detailed text analysis.
             else:
                 output_file = Path(output_file)
             
-            segments = self.segment_by_function(actions, screenshots)
-            
-            summary = self.summarize_functions(segments)
+            journal_file = output_file.parent / 'segments_journal.jsonl'
+            segments_file = output_file.parent / 'segments_data.json'
+            segments = self.segment_by_function(actions, screenshots, journal_file, ui_trees)
             
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(summary)
+            if self.config.incremental_summary:
+                # Add the new segments to the app's existing memory
+                if segments_file.exists():
+                    with open(segments_file, 'r', encoding='utf-8') as f:
+                        existing = [FunctionSegment(**data) for data in json.load(f)]
+                    # Repeated flows share descriptions, only identical segments are duplicates
+                    known = {self._segment_identity(segment) for segment in existing}
+                    segments = existing + [s for s in segments if self._segment_identity(s) not in known]
+                self.update_summary(segments, output_file)
+            else:
+                summary = self.summarize_functions(segments)
+                
+                self._write_summary(output_file, summary, {
+                    'segment_hashes': [self._segment_hash(segment) for segment in segments],
+                    'rebuild_size': len(segments),
+                    'changes_since_rebuild': 0
+                })
                 
             segments_data = []
             for segment in segments:
@@ -278,18 +750,39 @@ Format your response as a detailed text analysis.
                     'reasoning': segment.reasoning
                 })
                 
-            segments_file = output_file.parent / 'segments_data.json'
             with open(segments_file, 'w', encoding='utf-8') as f:
                 json.dump(segments_data, f, ensure_ascii=False, indent=2)
                 
+            # All results are saved, the next run starts from scratch
+            journal_file.unlink()
             self.logger.info(f"Successfully saved results to {output_file} and {segments_file}")
             
         except Exception as e:
             self.logger.error(f"Error in process_and_save: {str(e)}")
             raise
             
+    def process_many(self, recordings: List[tuple], max_parallel: int = 4) -> None:
+        """Process several recordings concurrently through the shared LLM client
+
+        Args:
+            recordings: (actions, screenshots, output_file[, ui_trees]) tuples; every
+                output file needs its own directory since segments_data.json is written next to it
+            max_parallel: Number of recordings processed at the same time
+        """
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            futures = [
+                executor.submit(self.process_and_save, *recording)
+                for recording in recordings
+            ]
+            for future in futures:
+                future.result()
+
     def search_rag(self, query_text: Optional[str] = None, 
                   query_image: Optional[str] = None, 
                   k: int = 3) -> List[RAGResult]:
         """Search RAG knowledge base"""
-        return self.rag_processor.search(query_text, query_image, k) 
\ No newline at end of file
+        return self.rag_processor.search(query_text, query_image, k)
+
+    def search_rag_batch(self, queries: List[RAGQuery], k: int = 3) -> List[List[RAGResult]]:
+        """Search RAG knowledge base for several queries with one embedding call per modality"""
+        return self.rag_processor.search_batch(queries, k)
@@ -0,0 +1,128 @@
+import logging
+import xml.etree.ElementTree as ET
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DIALOG_RESOURCE_IDS = ('android:id/alertTitle', 'android:id/parentPanel', 'android:id/buttonPanel')
+
+
+@dataclass
+class UISnapshot:
+    """Structural summary of a UI hierarchy dump"""
+    package: str
+    signatures: Counter = field(default_factory=Counter)
+    texts: List[str] = field(default_factory=list)
+    has_dialog: bool = False
+
+
+@lru_cache(maxsize=512)
+def parse_ui_tree(path: str) -> Optional[UISnapshot]:
+    """Parse a uiautomator dump into a UISnapshot, None if it cannot be read"""
+    try:
+        root = ET.parse(path).getroot()
+    except (OSError, ET.ParseError) as e:
+        logger.warning(f"Failed to parse UI tree {path}: {str(e)}")
+        return None
+
+    packages = Counter()
+    snapshot = UISnapshot(package='')
+    stack = [(node, 0) for node in root.findall('node')]
+    while stack:
+        node, depth = stack.pop()
+        cls = node.get('class', '')
+        resource_id = node.get('resource-id', '')
+        packages[node.get('package', '')] += 1
+        # Text is ignored so that content updates do not count as structural changes
+        snapshot.signatures[f"{depth}|{cls}|{resource_id}"] += 1
+        if 'Dialog' in cls or resource_id in DIALOG_RESOURCE_IDS:
+            snapshot.has_dialog = True
+        label = node.get('text') or node.get('content-desc')
+        if label:
+            snapshot.texts.append(label)
+        stack.extend((child, depth + 1) for child in node.findall('node'))
+    if packages:
+        snapshot.package = packages.most_common(1)[0][0]
+    return snapshot
+
+
+def structural_similarity(before: UISnapshot, after: UISnapshot) -> float:
+    """Weighted Jaccard similarity of two hierarchies' node signatures"""
+    intersection = sum((before.signatures & after.signatures).values())
+    union = sum((before.signatures | after.signatures).values())
+    return intersection / union if union else 1.0
+
+
+class UIBoundaryDetector:
+    """Detects obvious function boundaries from consecutive UI hierarchy dumps"""
+    def __init__(self, similarity_threshold: float = 0.3):
+        """Initialize detector
+
+        Args:
+            similarity_threshold: Transitions whose structural similarity is below
+                this value count as a screen replacement
+        """
+        self.similarity_threshold = similarity_threshold
+        self.local_cuts = 0
+        self.description_calls = 0
+        self.narrowed_windows = 0
+
+    def transition_reason(self, before: Optional[UISnapshot], after: Optional[UISnapshot]) -> Optional[str]:
+        """Return why the transition is an obvious boundary, or None"""
+        if before is None or after is None:
+            return None
+        if before.package != after.package:
+            return f"package changed from {before.package} to {after.package}"
+        if after.has_dialog and not before.has_dialog:
+            return "a dialog appeared"
+        if before.has_dialog and not after.has_dialog:
+            return "a dialog was dismissed"
+        similarity = structural_similarity(before, after)
+        if similarity < self.similarity_threshold:
+            return f"screen content replaced (structural similarity {similarity:.2f})"
+        return None
+
+    def find_boundary(self, ui_trees: List[str]) -> Optional[Tuple[int, str]]:
+        """Find the first obvious boundary in a window
+
+        Args:
+            ui_trees: UI tree paths of the window, one more than its actions
+
+        Returns:
+            Optional[Tuple[int, str]]: Number of actions before the boundary and its reason
+        """
+        snapshots = [parse_ui_tree(path) for path in ui_trees]
+        for i in range(1, len(snapshots)):
+            reason = self.transition_reason(snapshots[i - 1], snapshots[i])
+            if reason is not None:
+                return i, reason
+        return None
+
+    def screen_texts(self, ui_tree: str, max_texts: int = 8) -> List[str]:
+        """Distinct visible texts of a screen, in hierarchy order"""
+        snapshot = parse_ui_tree(ui_tree)
+        if snapshot is None:
+            return []
+        return list(dict.fromkeys(snapshot.texts))[:max_texts]
+
+    def reset_stats(self) -> None:
+        """Reset counters, called at the start of every recording"""
+        self.local_cuts = 0
+        self.description_calls = 0
+        self.narrowed_windows = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return how many segmentation calls were avoided and windows narrowed
+
+        Locally cut segments are described in batches, so every description
+        call is subtracted from the cuts.
+        """
+        return {
+            'local_cuts': self.local_cuts,
+            'description_calls': self.description_calls,
+            'llm_calls_avoided': self.local_cuts - self.description_calls,
+            'windows_narrowed': self.narrowed_windows,
+        }
@@ -0,0 +1,236 @@
+import base64
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from src.utils.cache import LRUCache
+from src.utils.image_hash import dhash, group_near_duplicates
+
+logger = logging.getLogger(__name__)
+
+_thread_local = threading.local()
+
+
+def _get_label_font(size: int = 48) -> ImageFont.ImageFont:
+    """Load the label font once per worker thread"""
+    fonts = getattr(_thread_local, 'fonts', None)
+    if fonts is None:
+        fonts = _thread_local.fonts = {}
+    if size not in fonts:
+        try:
+            fonts[size] = ImageFont.truetype("arial.ttf", size)
+        except OSError:
+            logger.warning("arial.ttf not available, falling back to default font")
+            fonts[size] = ImageFont.load_default()
+    return fonts[size]
+
+
+def compress_image(image: Image.Image, max_size: Tuple[int, int] = (800, 800)) -> Image.Image:
+    """Compress image size and drop the alpha channel
+
+    Args:
+        image: Original image
+        max_size: Maximum size (width, height)
+
+    Returns:
+        Image.Image: Loaded RGB image that fits into max_size, usable after
+            the source file is closed
+    """
+    # Let the JPEG decoder downscale while decoding (no-op for other formats)
+    image.draft('RGB', max_size)
+    image.thumbnail(max_size, Image.Resampling.LANCZOS)
+
+    # Create new RGB image (remove alpha channel)
+    if image.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    # An RGB image that already fits is still lazily backed by its file
+    image.load()
+    return image
+
+
+def draw_index_label(image: Image.Image, label: str, font_size: int = 48) -> Image.Image:
+    """Draw the window index in the upper left corner of a copy of the image"""
+    marked_image = image.copy()
+    draw = ImageDraw.Draw(marked_image)
+    font = _get_label_font(font_size)
+
+    # Add white background box, then draw large text in red
+    text_bbox = draw.textbbox((20, 20), label, font=font)
+    draw.rectangle([text_bbox[0]-20, text_bbox[1]-20, text_bbox[2]+20, text_bbox[3]+20],
+                   fill='white')
+    draw.text((20, 20), label, font=font, fill='red')
+    return marked_image
+
+
+def encode_image(image: Image.Image, quality: int = 60) -> bytes:
+    """Encode image as JPEG bytes"""
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def to_data_url(data: bytes, mime_type: str = "image/jpeg") -> str:
+    """Wrap encoded image bytes into a base64 data URL"""
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+@dataclass
+class PreparedImage:
+    """Encoded window screenshot ready for upload"""
+    url: str
+    width: int
+    height: int
+    indices: List[int]  # window positions shown in the image, also drawn as labels
+
+    @property
+    def index(self) -> int:
+        """First window position shown in the image"""
+        return self.indices[0]
+
+
+def pack_mosaic(images: List[Image.Image], cell_size: Tuple[int, int] = (270, 600),
+                columns: int = 4) -> Image.Image:
+    """Tile images row by row into a grid, each scaled to fit its cell
+
+    Args:
+        images: Images in reading order
+        cell_size: Cell resolution (width, height)
+        columns: Number of cells per row
+
+    Returns:
+        Image.Image: Grid image on a white background
+    """
+    columns = max(1, min(columns, len(images)))
+    rows = (len(images) + columns - 1) // columns
+    cell_width, cell_height = cell_size
+    mosaic = Image.new('RGB', (columns * cell_width, rows * cell_height), (255, 255, 255))
+    for i, image in enumerate(images):
+        cell = image.copy()
+        cell.thumbnail(cell_size, Image.Resampling.LANCZOS)
+        x = (i % columns) * cell_width + (cell_width - cell.width) // 2
+        y = (i // columns) * cell_height + (cell_height - cell.height) // 2
+        mosaic.paste(cell, (x, y))
+    return mosaic
+
+
+def _entry_nbytes(entry: Tuple[Image.Image, int]) -> int:
+    image = entry[0]
+    return image.width * image.height * len(image.getbands())
+
+
+class WindowImagePreparer:
+    """Prepares labelled window screenshots for upload entirely in memory
+
+    Compressed base images (and their perceptual hashes) are cached by
+    screenshot content hash and target size, so overlapping windows only
+    redo the index label and encoding.
+    """
+    def __init__(self, max_size: Tuple[int, int] = (800, 800), quality: int = 60,
+                 max_workers: int = 4, cache_max_bytes: int = 256 * 1024 * 1024):
+        self.max_size = tuple(max_size)
+        self.quality = quality
+        self.max_workers = max_workers
+        self.cache = LRUCache(cache_max_bytes, sizeof=_entry_nbytes)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="window-image"
+            )
+        return self._executor
+
+    def _map(self, fn: Callable, items: Sequence) -> list:
+        """Apply fn to items on the worker pool, preserving order"""
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [fn(item) for item in items]
+        return list(self._get_executor().map(fn, items))
+
+    def _get_base_image(self, screenshot: str) -> Tuple[Image.Image, int]:
+        """Return the compressed screenshot and its dHash, decoding only on a cache miss"""
+        with open(screenshot, "rb") as f:
+            data = f.read()
+        key = (hashlib.sha1(data).hexdigest(), self.max_size)
+        entry = self.cache.get(key)
+        if entry is None:
+            with Image.open(BytesIO(data)) as image:
+                base_image = compress_image(image, self.max_size)
+            entry = (base_image, dhash(base_image))
+            self.cache.put(key, entry)
+        return entry
+
+    def _label_and_encode(self, index: int, base_image: Image.Image) -> PreparedImage:
+        """Label and encode a single compressed screenshot"""
+        marked_image = draw_index_label(base_image, str(index))
+        url = to_data_url(encode_image(marked_image, self.quality))
+        return PreparedImage(url=url, width=marked_image.width, height=marked_image.height, indices=[index])
+
+    def prepare(self, screenshots: List[str],
+                near_duplicate_threshold: Optional[int] = None) -> List[PreparedImage]:
+        """Prepare window screenshots, labelled by their position in the window
+
+        Args:
+            screenshots: Screenshot paths of the window
+            near_duplicate_threshold: If set, screenshots within this dHash Hamming
+                distance of the preceding kept screenshot are dropped
+
+        Returns:
+            List[PreparedImage]: Base64 data URLs and sizes in window order
+        """
+        entries, indices = self._select(screenshots, near_duplicate_threshold)
+        return self._map(lambda i: self._label_and_encode(i, entries[i][0]), indices)
+
+    def _select(self, screenshots: List[str], near_duplicate_threshold: Optional[int]) -> tuple:
+        """Load base images and pick the window indices to send"""
+        entries = self._map(self._get_base_image, screenshots)
+        indices = list(range(len(screenshots)))
+        if near_duplicate_threshold is not None:
+            representatives = group_near_duplicates([h for _, h in entries], near_duplicate_threshold)
+            indices = [i for i in indices if representatives[i] == i]
+        return entries, indices
+
+    def prepare_mosaics(self, screenshots: List[str], near_duplicate_threshold: Optional[int] = None,
+                        cell_size: Tuple[int, int] = (270, 600), columns: int = 4,
+                        max_cells: int = 8) -> List[PreparedImage]:
+        """Prepare labelled window screenshots packed into grid images
+
+        Args:
+            screenshots: Screenshot paths of the window
+            near_duplicate_threshold: See `prepare`
+            cell_size: Cell resolution (width, height)
+            columns: Number of cells per row
+            max_cells: Maximum number of screenshots per grid image
+
+        Returns:
+            List[PreparedImage]: Encoded grid images in window order
+        """
+        entries, indices = self._select(screenshots, near_duplicate_threshold)
+        labelled = self._map(lambda i: draw_index_label(entries[i][0], str(i)), indices)
+        chunks = [list(range(start, min(start + max_cells, len(indices))))
+                  for start in range(0, len(indices), max_cells)]
+
+        def pack(chunk: List[int]) -> PreparedImage:
+            mosaic = pack_mosaic([labelled[j] for j in chunk], cell_size, columns)
+            url = to_data_url(encode_image(mosaic, self.quality))
+            return PreparedImage(url=url, width=mosaic.width, height=mosaic.height,
+                                 indices=[indices[j] for j in chunk])
+
+        return self._map(pack, chunks)
+
+    def close(self) -> None:
+        """Shut down the worker pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -1,107 +1,584 @@
 import faiss
 import numpy as np
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 import logging
+import json
+import os
+import threading
+import time
+from dataclasses import asdict
 from pathlib import Path
 
-from src.models.models import FunctionSegment, RAGResult
+from src.models.models import FunctionSegment, RAGQuery, RAGResult
 from src.models.gme_model import GmeQwen2VL, GmeAPI
+from src.utils.image_hash import dhash_file, group_near_duplicates
+from src.utils.ann_index import ANNIndex
+from src.utils.cache import LRUCache
+from src.utils.embedding_cache import content_digest
 
 logger = logging.getLogger(__name__)
 
+# Version of the on-disk index layout written by RAGProcessor.save
+INDEX_FORMAT_VERSION = 4
+
+# Image hits fetched per requested result, frames of one segment are merged afterwards
+IMAGE_CANDIDATE_FACTOR = 4
+
+FUSION_MODES = ('none', 'rrf', 'weighted')
+
+def _as_matrix(embeddings) -> np.ndarray:
+    """Convert embeddings (numpy array or torch tensor) to a contiguous float32 matrix"""
+    return np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32))
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so that squared L2 distance d maps to cosine similarity 1 - d / 2"""
+    if matrix.ndim != 2 or len(matrix) == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.ascontiguousarray(matrix / np.maximum(norms, 1e-12), dtype=np.float32)
+
+def _cosine(distances: np.ndarray) -> np.ndarray:
+    """Cosine similarity of normalized vectors from their squared L2 distance"""
+    return 1 - distances / 2
+
 class RAGProcessor:
-    """RAG Processor Class"""
-    def __init__(self, gme_model: GmeAPI):
+    """RAG Processor Class
+
+    Both indices are ID-mapped: text vectors carry their segment ID, image
+    vectors carry a 64-bit image ID that indexes compact arrays holding the
+    owning segment ID and frame offset. Segments can therefore be added and
+    removed without rebuilding the indices. The FAISS backend of each index
+    is chosen by index_type, 'auto' picks one from the corpus size at build time.
+
+    Adding, removing, searching, saving and loading hold one lock, so a
+    streaming segmenter can add segments while an agent searches; embedding
+    runs outside of it.
+
+    All vectors are L2-normalized, scores are cosine similarities. Text and
+    image hits of a query are either listed separately (fusion 'none') or
+    fused into one result per segment by reciprocal rank fusion ('rrf') or a
+    weighted sum of cosine similarities ('weighted').
+    """
+    def __init__(self, gme_model: GmeAPI, near_duplicate_threshold: Optional[int] = None,
+                 index_type: str = 'auto', nlist: Optional[int] = None, nprobe: int = 8,
+                 pq_m: int = 16, hnsw_m: int = 32, ef_search: int = 64,
+                 fusion: str = 'none', fusion_candidates: int = 20,
+                 text_weight: float = 0.5, rrf_k: int = 60,
+                 query_cache_max_bytes: int = 64 * 1024 * 1024,
+                 query_cache_ttl: Optional[float] = 600.0):
+        """Initialize RAG processor
+
+        Args:
+            gme_model: Embedding model
+            near_duplicate_threshold: If set, consecutive screenshots of a segment within
+                this dHash Hamming distance are embedded once
+            index_type: 'auto', 'flat', 'ivf_flat', 'ivf_pq' or 'hnsw'
+            nlist: Number of IVF lists, derived from the corpus size if not set
+            nprobe: IVF lists visited per query
+            pq_m: Sub-quantizers of IVF-PQ codes
+            hnsw_m: Neighbours per HNSW node
+            ef_search: HNSW candidate list size while searching
+            fusion: Default fusion of text and image hits, 'none', 'rrf' or 'weighted'
+            fusion_candidates: Segments retrieved per modality before fusion
+            text_weight: Weight of the text similarity in weighted fusion, the image
+                similarity gets 1 - text_weight
+            rrf_k: Rank offset of reciprocal rank fusion
+            query_cache_max_bytes: Memory for cached query embeddings, 0 disables the cache
+            query_cache_ttl: Seconds a cached query embedding stays valid, None for no expiry
+        """
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"Unknown fusion mode: {fusion}, expected one of {FUSION_MODES}")
         self.gme_model = gme_model
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.index_settings = dict(index_type=index_type, nlist=nlist, nprobe=nprobe,
+                                   pq_m=pq_m, hnsw_m=hnsw_m, ef_search=ef_search)
+        self.fusion = fusion
+        self.fusion_candidates = fusion_candidates
+        self.text_weight = text_weight
+        self.rrf_k = rrf_k
+        # Query embeddings by modality and normalized text or image content hash
+        self.query_cache = LRUCache(query_cache_max_bytes, sizeof=lambda vector: vector.nbytes,
+                                    ttl=query_cache_ttl)
+        self._query_embed_seconds = 0.0
+        self._query_embed_count = 0
         self.text_index = None
         self.image_index = None
-        self.segments = []
-        
+        self.segments: Dict[int, FunctionSegment] = {}
+        # Owning segment ID and frame offset of every image ID (-1 once removed),
+        # and image IDs of every segment
+        self.image_segment_ids = np.empty(0, dtype=np.int64)
+        self.image_frames = np.empty(0, dtype=np.int32)
+        self.segment_images: Dict[int, List[int]] = {}
+        self._next_segment_id = 0
+        self._next_image_id = 0
+        # Directory of a memory-mapped index, reloaded into memory before modification
+        self._mmap_dir: Optional[Path] = None
+        self._index_states: Dict[str, dict] = {}
+        # Guards the indices and the segment metadata, reentrant for build_index
+        self._lock = threading.RLock()
+
+    def _select_screenshots(self, screenshots: List[str]) -> List[int]:
+        """Frame offsets of the representative screenshots of a segment, one per near-duplicate group"""
+        if self.near_duplicate_threshold is None:
+            return list(range(len(screenshots)))
+        hashes = [dhash_file(path) for path in screenshots]
+        representatives = group_near_duplicates(hashes, self.near_duplicate_threshold)
+        return [i for i in range(len(screenshots)) if representatives[i] == i]
+
+    def _embed_segments(self, segments: List[FunctionSegment]) -> tuple:
+        """Embed segment texts and screenshots
+
+        Returns:
+            tuple: Text embeddings, image embeddings, and the position (within
+                segments) of the owning segment and the frame offset of each
+                image embedding
+        """
+        # Prepare text data
+        text_data = []
+        for segment in segments:
+            text_data.append(f"{segment.func_desc} {segment.reasoning}")
+
+        # Verify image files exist
+        for segment in segments:
+            for image_path in segment.screenshots:
+                if not Path(image_path).exists():
+                    raise FileNotFoundError(f"Image file not found: {image_path}")
+
+        # Prepare image data, FunctionSegment.screenshots keeps every original file
+        image_data = []
+        image_positions = []
+        image_frames = []
+        for position, segment in enumerate(segments):
+            selected = self._select_screenshots(segment.screenshots)
+            image_data.extend(segment.screenshots[frame] for frame in selected)
+            image_positions.extend([position] * len(selected))
+            image_frames.extend(selected)
+        skipped = sum(len(segment.screenshots) for segment in segments) - len(image_data)
+        if skipped:
+            logger.info(f"Skipped {skipped} near-duplicate screenshots")
+
+        text_embeddings = self._embed_texts(text_data)
+        image_embeddings = self._embed_images(image_data, is_query=False)
+        return text_embeddings, image_embeddings, image_positions, image_frames
+
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Embed texts in one batched call"""
+        return _normalize(_as_matrix(self.gme_model.get_text_embeddings(texts)))
+
+    def _embed_images(self, images: List[str], is_query: bool) -> np.ndarray:
+        """Embed images in one batched call
+
+        GmeAPI and GmeQwen2VL name their image argument differently and only
+        the local model distinguishes queries, so the list is passed positionally.
+        """
+        if isinstance(self.gme_model, GmeQwen2VL):
+            embeddings = self.gme_model.get_image_embeddings(images, is_query=is_query)
+        else:
+            embeddings = self.gme_model.get_image_embeddings(images)
+        return _normalize(_as_matrix(embeddings))
+
+    def _reset(self) -> None:
+        self.text_index = None
+        self.image_index = None
+        self.segments = {}
+        self.image_segment_ids = np.empty(0, dtype=np.int64)
+        self.image_frames = np.empty(0, dtype=np.int32)
+        self.segment_images = {}
+        self._next_segment_id = 0
+        self._next_image_id = 0
+        self._mmap_dir = None
+
     def build_index(self, segments: List[FunctionSegment]) -> None:
         """Build RAG index"""
         try:
-            self.segments = segments
-            
-            # Prepare text data
-            text_data = []
-            for segment in segments:
-                text_data.append(f"{segment.func_desc} {segment.reasoning}")
-            
-            # Prepare image data
-            image_data = []
-            for segment in segments:
-                image_data.extend(segment.screenshots)
-            
-            # Verify image files exist
-            for image_path in image_data:
-                if not Path(image_path).exists():
-                    raise FileNotFoundError(f"Image file not found: {image_path}")
-            
-            # Generate text embeddings
-            text_embeddings = self.gme_model.get_text_embeddings(
-                texts=text_data,
-            )
-            
-            # Generate image embeddings
-            image_embeddings = self.gme_model.get_image_embeddings(
-                image_paths=image_data,
-            )
-            
-            # Create FAISS indices
-            dimension = text_embeddings.shape[1]
-            self.text_index = faiss.IndexFlatL2(dimension)
-            self.image_index = faiss.IndexFlatL2(dimension)
-            
-            # Add embeddings to indices
-            self.text_index.add(text_embeddings)
-            self.image_index.add(image_embeddings)
-            
+            with self._lock:
+                self._reset()
+                self.add_segments(segments)
             logger.info(f"Successfully built RAG index with {len(segments)} segments")
-            
+
         except Exception as e:
             logger.error(f"Error building RAG index: {str(e)}")
             raise
-            
+
+    def add_segments(self, segments: List[FunctionSegment]) -> List[int]:
+        """Embed new segments and add them to the indices
+
+        Only the given segments are embedded, the existing index is kept.
+
+        Returns:
+            List[int]: IDs assigned to the segments
+        """
+        if not segments:
+            return []
+        try:
+            text_embeddings, image_embeddings, image_positions, image_frames = self._embed_segments(segments)
+            with self._lock:
+                self._ensure_writable()
+                if self.text_index is None:
+                    # The FAISS indices are created on the first batch and rebuilt as the pool grows
+                    self.text_index = ANNIndex(**self.index_settings)
+                    self.image_index = ANNIndex(**self.index_settings)
+
+                segment_ids = list(range(self._next_segment_id, self._next_segment_id + len(segments)))
+                self._next_segment_id += len(segments)
+                image_ids = list(range(self._next_image_id, self._next_image_id + len(image_positions)))
+                self._next_image_id += len(image_positions)
+
+                # Metadata is published before the vectors that refer to it
+                owners = np.asarray(segment_ids, dtype=np.int64)[np.asarray(image_positions, dtype=np.int64)]
+                self.image_segment_ids = np.concatenate([self.image_segment_ids, owners])
+                self.image_frames = np.concatenate([self.image_frames, np.asarray(image_frames, dtype=np.int32)])
+                for segment_id, segment in zip(segment_ids, segments):
+                    self.segments[segment_id] = segment
+                    self.segment_images[segment_id] = []
+                for image_id, position in zip(image_ids, image_positions):
+                    self.segment_images[segment_ids[position]].append(image_id)
+
+                self.text_index.add(text_embeddings, segment_ids)
+                self.image_index.add(image_embeddings, image_ids)
+            logger.info(f"Added {len(segments)} segments to RAG index")
+            return segment_ids
+        except Exception as e:
+            logger.error(f"Error adding segments to RAG index: {str(e)}")
+            raise
+
+    def remove_segments(self, segment_ids: List[int]) -> int:
+        """Remove segments and their image vectors from the indices
+
+        Returns:
+            int: Number of segments removed
+        """
+        with self._lock:
+            segment_ids = [segment_id for segment_id in segment_ids if segment_id in self.segments]
+            if not segment_ids:
+                return 0
+            self._ensure_writable()
+            image_ids = [image_id for segment_id in segment_ids for image_id in self.segment_images[segment_id]]
+            # Vectors are removed before the metadata they refer to
+            self.text_index.remove(segment_ids)
+            self.image_index.remove(image_ids)
+            for segment_id in segment_ids:
+                del self.segments[segment_id]
+                del self.segment_images[segment_id]
+            self.image_segment_ids[image_ids] = -1
+            self.image_frames[image_ids] = -1
+        logger.info(f"Removed {len(segment_ids)} segments from RAG index")
+        return len(segment_ids)
+
+    def save(self, path: str) -> None:
+        """Save indices, segment metadata and the image ID map to a directory
+
+        Layout (format version 4, vectors are L2-normalized):
+            manifest.json: format version, dimension, index types, ID counters and item counts, written last
+            segments.json: segment IDs and metadata
+            image_segments.npy, image_frames.npy: owning segment ID and frame offset per image ID
+            text.faiss, image.faiss: ID-mapped FAISS indices
+
+        Every file is written next to its target and renamed over it, so
+        saving into the directory the index was memory-mapped from never
+        overwrites a mapped file in place.
+        """
+        with self._lock:
+            if self.text_index is None:
+                raise ValueError("Index has not been built")
+            path = Path(path)
+            path.mkdir(parents=True, exist_ok=True)
+            # Drop the manifest first so an interrupted save is never loaded
+            manifest_file = path / "manifest.json"
+            if manifest_file.exists():
+                manifest_file.unlink()
+
+            self._replace_file(path / "text.faiss", lambda tmp: self.text_index.write(str(tmp)))
+            self._replace_file(path / "image.faiss", lambda tmp: self.image_index.write(str(tmp)))
+            self._replace_file(path / "image_segments.npy", lambda tmp: np.save(tmp, self.image_segment_ids))
+            self._replace_file(path / "image_frames.npy", lambda tmp: np.save(tmp, self.image_frames))
+            with open(path / "segments.json", 'w', encoding='utf-8') as f:
+                json.dump([{"id": segment_id, **asdict(segment)} for segment_id, segment in self.segments.items()],
+                          f, ensure_ascii=False)
+            with open(manifest_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "format_version": INDEX_FORMAT_VERSION,
+                    "dimension": self.text_index.d,
+                    "num_segments": len(self.segments),
+                    "num_images": self.image_index.ntotal,
+                    "next_segment_id": self._next_segment_id,
+                    "next_image_id": self._next_image_id,
+                    "text_index": self.text_index.state(),
+                    "image_index": self.image_index.state(),
+                    "near_duplicate_threshold": self.near_duplicate_threshold,
+                }, f, indent=2)
+        logger.info(f"Saved RAG index with {len(self.segments)} segments to {path}")
+
+    @staticmethod
+    def _replace_file(target: Path, write: Callable[[Path], None]) -> None:
+        """Write a file through a temporary name, leaving a mapped old file intact"""
+        # The suffix is kept so np.save does not append another one
+        tmp = target.with_name(f".{target.stem}.tmp{target.suffix}")
+        write(tmp)
+        os.replace(tmp, target)
+
+    def load(self, path: str, mmap: bool = True) -> None:
+        """Load an index written by `save`
+
+        Args:
+            path: Index directory
+            mmap: Memory-map the vectors instead of reading them into memory, only
+                flat indices on FAISS builds with IO_FLAG_MMAP_IFC are mapped;
+                the mode that took effect is logged. Mapped indices are read
+                into memory in full on the first add or remove
+        """
+        path = Path(path)
+        with open(path / "manifest.json", 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        version = manifest.get("format_version")
+        if version != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported RAG index format version {version}, expected {INDEX_FORMAT_VERSION}; "
+                             f"rebuild the index")
+
+        with open(path / "segments.json", 'r', encoding='utf-8') as f:
+            segments_data = json.load(f)
+        image_segment_ids = np.load(path / "image_segments.npy")
+        image_frames = np.load(path / "image_frames.npy")
+
+        with self._lock:
+            self._reset()
+            self._index_states = {"text": manifest["text_index"], "image": manifest["image_index"]}
+            self.text_index, text_mapped = self._read_index(path / "text.faiss", self._index_states["text"], mmap)
+            self.image_index, image_mapped = self._read_index(path / "image.faiss", self._index_states["image"], mmap)
+            for data in segments_data:
+                segment_id = data.pop("id")
+                self.segments[segment_id] = FunctionSegment(**data)
+                self.segment_images[segment_id] = []
+            self.image_segment_ids = image_segment_ids
+            self.image_frames = image_frames
+            for image_id, segment_id in enumerate(image_segment_ids.tolist()):
+                if segment_id >= 0:
+                    self.segment_images[segment_id].append(image_id)
+            self._next_segment_id = manifest["next_segment_id"]
+            self._next_image_id = manifest["next_image_id"]
+            self.near_duplicate_threshold = manifest.get("near_duplicate_threshold", self.near_duplicate_threshold)
+            self._mmap_dir = path if text_mapped or image_mapped else None
+        logger.info(f"Loaded RAG index with {len(self.segments)} segments from {path}")
+
+    def _read_index(self, index_file: Path, state: dict, mmap: bool) -> Tuple[ANNIndex, bool]:
+        """Read an index, returning it and whether its vectors are memory-mapped"""
+        index = ANNIndex(**self.index_settings)
+        # Only the codes of flat indices can be mapped, and only by FAISS builds with IO_FLAG_MMAP_IFC
+        mapped = mmap and state["kind"] == 'flat' and hasattr(faiss, "IO_FLAG_MMAP_IFC")
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if mapped else 0
+        index.read(str(index_file), state, flags)
+        if mapped:
+            logger.info(f"Memory-mapped {index_file.name}")
+        elif mmap and state["kind"] != 'flat':
+            logger.info(f"Read {index_file.name} into memory, {state['kind']} indices are not memory-mapped")
+        elif mmap:
+            logger.warning(f"Read {index_file.name} into memory, this FAISS build cannot memory-map flat indices")
+        return index, mapped
+
+    def _ensure_writable(self) -> None:
+        """Replace memory-mapped, read-only indices with in-memory copies
+
+        Called by the first add or remove after an mmap load. It reads every
+        mapped index file in full, which costs I/O and memory proportional to
+        the pool, once per load; indices that were not mapped are kept.
+        """
+        if self._mmap_dir is None:
+            return
+        # Only flat indices are ever mapped
+        if self._index_states["text"]["kind"] == 'flat':
+            self.text_index, _ = self._read_index(self._mmap_dir / "text.faiss", self._index_states["text"], False)
+        if self._index_states["image"]["kind"] == 'flat':
+            self.image_index, _ = self._read_index(self._mmap_dir / "image.faiss", self._index_states["image"], False)
+        self._mmap_dir = None
+
+    def _embed_queries(self, values: List[str], modality: str) -> np.ndarray:
+        """Embed query texts or images, reusing cached query embeddings"""
+        if modality == 'text':
+            # Whitespace differences do not change the query
+            keys = [('text', ' '.join(value.split())) for value in values]
+        else:
+            keys = [('image', content_digest(value)) for value in values]
+        vectors = [self.query_cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            start = time.perf_counter()
+            if modality == 'text':
+                embeddings = self._embed_texts([values[i] for i in missing])
+            else:
+                embeddings = self._embed_images([values[i] for i in missing], is_query=True)
+            self._query_embed_seconds += time.perf_counter() - start
+            self._query_embed_count += len(missing)
+            for i, vector in zip(missing, embeddings):
+                vectors[i] = vector
+                # A row view would keep the whole batch matrix alive while only its row is counted
+                self.query_cache.put(keys[i], vector.copy())
+        return np.ascontiguousarray(np.stack(vectors), dtype=np.float32)
+
+    def query_cache_stats(self) -> Dict[str, float]:
+        """Return query cache counters and the embedding latency saved by hits
+
+        The saving is estimated from the mean embedding time of missed queries.
+        """
+        stats = self.query_cache.stats()
+        mean_seconds = self._query_embed_seconds / self._query_embed_count if self._query_embed_count else 0.0
+        stats['mean_embed_ms'] = mean_seconds * 1000
+        stats['latency_saved_s'] = stats['hits'] * mean_seconds
+        return stats
+
+    def _text_hits(self, distances: np.ndarray, ids: np.ndarray) -> List[tuple]:
+        """(segment ID, cosine similarity, None) of the text hits of one query"""
+        # FAISS pads missing results with -1
+        return [(int(idx), float(score), None)
+                for idx, score in zip(ids.tolist(), _cosine(distances).tolist()) if idx >= 0]
+
+    def _aggregate_image_hits(self, distances: np.ndarray, ids: np.ndarray, k: int,
+                              aggregation: str) -> List[tuple]:
+        """Combine hits on frames of the same segment into one hit per segment
+
+        Args:
+            distances: Distances of the image hits
+            ids: Image IDs of the hits, -1 for padding
+            k: Number of segments to return
+            aggregation: 'max' keeps the best frame score, 'sum' adds the frame scores
+
+        Returns:
+            List[tuple]: Top-k (segment ID, score, offset of the best matching frame)
+        """
+        if aggregation not in ('max', 'sum'):
+            raise ValueError(f"Unknown image aggregation: {aggregation}")
+        valid = ids >= 0
+        ids = ids[valid]
+        scores = _cosine(distances[valid])
+        segment_ids = self.image_segment_ids[ids]
+        frames = self.image_frames[ids]
+
+        totals: Dict[int, float] = {}
+        best: Dict[int, int] = {}
+        for segment_id, frame, score in zip(segment_ids.tolist(), frames.tolist(), scores.tolist()):
+            # Hits are sorted by distance, the first hit of a segment is its best frame
+            if segment_id not in best:
+                best[segment_id] = frame
+                totals[segment_id] = score
+            elif aggregation == 'sum':
+                totals[segment_id] += score
+
+        ranked = sorted(totals, key=totals.get, reverse=True)[:k]
+        return [(segment_id, totals[segment_id], best[segment_id]) for segment_id in ranked]
+
+    def _fuse(self, text_hits: List[tuple], image_hits: List[tuple], fusion: str) -> List[RAGResult]:
+        """Fuse the text and image hits of a query into one result per segment"""
+        scores: Dict[int, float] = {}
+        modalities: Dict[int, set] = {}
+        frames: Dict[int, int] = {}
+        for modality, hits, weight in (('text', text_hits, self.text_weight),
+                                       ('image', image_hits, 1 - self.text_weight)):
+            for rank, (segment_id, score, frame) in enumerate(hits):
+                if fusion == 'rrf':
+                    contribution = 1 / (self.rrf_k + rank + 1)
+                else:
+                    contribution = weight * score
+                scores[segment_id] = scores.get(segment_id, 0.0) + contribution
+                modalities.setdefault(segment_id, set()).add(modality)
+                if frame is not None:
+                    frames[segment_id] = frame
+
+        return [RAGResult(
+            segment=self.segments[segment_id],
+            similarity_score=float(score),
+            match_type='both' if len(modalities[segment_id]) == 2 else next(iter(modalities[segment_id])),
+            frame_index=frames.get(segment_id)
+        ) for segment_id, score in scores.items()]
+
     def search(self, query_text: Optional[str] = None, 
               query_image: Optional[str] = None, 
-              k: int = 3) -> List[RAGResult]:
-        """Search RAG knowledge base"""
-        if query_text is None and query_image is None:
-            raise ValueError("Either query_text or query_image must be provided")
-            
-        results = []
-        
-        # Text search
-        if query_text:
-            query_text_embedding = self.gme_model.get_text_embeddings(
-                texts=[query_text]
-            )
-            D_text, I_text = self.text_index.search(query_text_embedding, k)
-            
-            for i, (distance, idx) in enumerate(zip(D_text[0], I_text[0])):
-                results.append(RAGResult(
-                    segment=self.segments[idx],
-                    similarity_score=float(1 / (1 + distance)),
-                    match_type='text'
-                ))
-        
-        # Image search
-        if query_image:
-            query_image_embedding = self.gme_model.get_image_embeddings(
-                images=[query_image],
-                is_query=True
-            )
-            D_image, I_image = self.image_index.search(query_image_embedding, k)
-            
-            for i, (distance, idx) in enumerate(zip(D_image[0], I_image[0])):
-                # Find corresponding segment
-                segment_idx = idx // len(self.segments[0].screenshots)
-                results.append(RAGResult(
-                    segment=self.segments[segment_idx],
-                    similarity_score=float(1 / (1 + distance)),
-                    match_type='image'
-                ))
-        
-        # Merge and sort results
-        results.sort(key=lambda x: x.similarity_score, reverse=True)
-        return results[:k] 
\ No newline at end of file
+              k: int = 3,
+              image_aggregation: str = 'max',
+              fusion: Optional[str] = None) -> List[RAGResult]:
+        """Search RAG knowledge base
+
+        Args:
+            query_text: Text query
+            query_image: Image query
+            k: Number of results
+            image_aggregation: How hits on several frames of one segment are
+                combined, 'max' or 'sum'
+            fusion: 'none', 'rrf' or 'weighted', defaults to the processor's setting
+
+        Returns:
+            List[RAGResult]: Results sorted by similarity
+        """
+        return self.search_batch([RAGQuery(text=query_text, image=query_image)], k,
+                                 image_aggregation, fusion)[0]
+
+    def search_batch(self, queries: List[RAGQuery], k: int = 3,
+                     image_aggregation: str = 'max',
+                     fusion: Optional[str] = None) -> List[List[RAGResult]]:
+        """Search RAG knowledge base for several queries at once
+
+        All text queries are embedded in one call and searched with one FAISS
+        search over the query matrix, and likewise all image queries. With
+        fusion, each modality contributes at most fusion_candidates segments
+        (and never fewer than k) before fusing.
+
+        Args:
+            queries: Queries, each with a text and/or an image
+            k: Number of results per query
+            image_aggregation: How hits on several frames of one segment are
+                combined, 'max' or 'sum'
+            fusion: 'none', 'rrf' or 'weighted', defaults to the processor's setting
+
+        Returns:
+            List[List[RAGResult]]: Results of each query sorted by similarity
+        """
+        fusion = fusion or self.fusion
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"Unknown fusion mode: {fusion}, expected one of {FUSION_MODES}")
+        for query in queries:
+            if query.text is None and query.image is None:
+                raise ValueError("Either query_text or query_image must be provided")
+        if self.text_index is None:
+            raise ValueError("Index has not been built")
+
+        per_modality = k if fusion == 'none' else max(k, self.fusion_candidates)
+        text_hits: List[List[tuple]] = [[] for _ in queries]
+        image_hits: List[List[tuple]] = [[] for _ in queries]
+
+        # Queries are embedded before taking the lock, concurrent adds are not held up by the model
+        text_rows = [row for row, query in enumerate(queries) if query.text]
+        if text_rows:
+            text_embeddings = self._embed_queries([queries[row].text for row in text_rows], 'text')
+        image_rows = [row for row, query in enumerate(queries) if query.image]
+        if image_rows and self.image_index.ntotal > 0:
+            image_embeddings = self._embed_queries([queries[row].image for row in image_rows], 'image')
+        else:
+            image_rows = []
+
+        with self._lock:
+            # Text search
+            if text_rows:
+                D_text, I_text = self.text_index.search(text_embeddings, per_modality)
+                for row, distances, ids in zip(text_rows, D_text, I_text):
+                    text_hits[row] = self._text_hits(distances, ids)
+
+            # Image search, fetching extra frames so enough distinct segments remain after aggregation
+            candidates = min(self.image_index.ntotal, per_modality * IMAGE_CANDIDATE_FACTOR)
+            if image_rows and candidates > 0:
+                D_image, I_image = self.image_index.search(image_embeddings, candidates)
+                for row, distances, ids in zip(image_rows, D_image, I_image):
+                    image_hits[row] = self._aggregate_image_hits(distances, ids, per_modality, image_aggregation)
+
+            results = []
+            for row in range(len(queries)):
+                if fusion == 'none':
+                    row_results = [RAGResult(
+                        segment=self.segments[segment_id],
+                        similarity_score=score,
+                        match_type=match_type,
+                        frame_index=frame
+                    ) for match_type, hits in (('text', text_hits[row]), ('image', image_hits[row]))
+                        for segment_id, score, frame in hits]
+                else:
+                    row_results = self._fuse(text_hits[row], image_hits[row], fusion)
+                row_results.sort(key=lambda x: x.similarity_score, reverse=True)
+                results.append(row_results[:k])
+        return results
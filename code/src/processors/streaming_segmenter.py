@@ -0,0 +1,139 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from src.models.models import FunctionSegment
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingSegmenter:
+    """Online segmentation fed one (action, screenshot) pair at a time
+
+    Pairs are buffered until a window is full; windows are then segmented on a
+    background worker so the testing agent is never blocked by LLM calls.
+    Closed segments are added to the RAG index and passed to `on_segment`, in
+    order; segments cut locally at UI boundaries are held back until a batch
+    of them has been described (or the segmenter is flushed).
+    """
+    def __init__(
+        self,
+        processor,
+        initial_screenshot: str,
+        on_segment: Optional[Callable[[FunctionSegment], None]] = None,
+        update_index: bool = True,
+        initial_ui_tree: Optional[str] = None,
+    ):
+        """Initialize segmenter
+
+        Args:
+            processor: ActionHistoryProcessor used to segment windows
+            initial_screenshot: Screenshot before the first action
+            on_segment: Callback invoked with every closed segment
+            update_index: Whether to add closed segments to the processor's RAG index
+            initial_ui_tree: UI tree before the first action; if given, every push
+                must provide a UI tree too and local boundary detection is used
+        """
+        self.processor = processor
+        self.on_segment = on_segment
+        self.update_index = update_index
+        self.segments: List[FunctionSegment] = []
+        self.window_policy = processor.new_window_policy()
+
+        # Pending actions and their screenshots, screenshots has one extra entry
+        self._actions: List[str] = []
+        self._screenshots: List[str] = [initial_screenshot]
+        self._ui_trees: Optional[List[str]] = None if initial_ui_tree is None else [initial_ui_tree]
+        self._offset = 0
+        # Closed segments waiting for the description of a local cut, as (segment, ui_trees)
+        self._buffered: List[tuple] = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="streaming-segmenter")
+        self._error: Optional[BaseException] = None
+
+    @property
+    def window_size(self) -> int:
+        return self.window_policy.size
+
+    def push(self, action: str, screenshot: str, ui_tree: Optional[str] = None) -> None:
+        """Add an action and the screenshot (and UI tree) captured after it"""
+        self._raise_error()
+        if (self._ui_trees is None) != (ui_tree is None):
+            raise ValueError("ui_tree must be given for every push if and only if initial_ui_tree was given")
+        with self._lock:
+            self._actions.append(action)
+            self._screenshots.append(screenshot)
+            if self._ui_trees is not None:
+                self._ui_trees.append(ui_tree)
+            ready = len(self._actions) >= self.window_size
+        if ready:
+            # The single worker runs drains in order, redundant ones are no-ops
+            self._executor.submit(self._drain, False)
+
+    def flush(self) -> List[FunctionSegment]:
+        """Segment all buffered actions and wait for completion
+
+        Returns:
+            List[FunctionSegment]: All segments closed so far
+        """
+        self._executor.submit(self._drain, True).result()
+        self._raise_error()
+        return list(self.segments)
+
+    def close(self) -> List[FunctionSegment]:
+        """Flush remaining actions and stop the worker"""
+        try:
+            return self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _drain(self, final: bool) -> None:
+        """Close segments while a full window (or, when final, any action) is buffered"""
+        if self._error is not None:
+            return
+        try:
+            while True:
+                with self._lock:
+                    pending = len(self._actions)
+                    if pending == 0 or (not final and pending < self.window_size):
+                        break
+                    end = min(self.window_size, pending)
+                    window_actions = self._actions[:end]
+                    window_screenshots = self._screenshots[:end + 1]
+                    window_ui_trees = None if self._ui_trees is None else self._ui_trees[:end + 1]
+                    offset = self._offset
+
+                segment, consumed = self.processor._segment_window(
+                    window_actions, window_screenshots, offset, offset + end,
+                    window_ui_trees, self.window_policy
+                )
+
+                with self._lock:
+                    del self._actions[:consumed]
+                    del self._screenshots[:consumed]
+                    if self._ui_trees is not None:
+                        del self._ui_trees[:consumed]
+                    self._offset += consumed
+                self._buffered.append((segment, None if window_ui_trees is None else window_ui_trees[:consumed + 1]))
+                for segment, _ in self.processor._release_segments(self._buffered, False):
+                    self._emit(segment)
+            if final:
+                for segment, _ in self.processor._release_segments(self._buffered, True):
+                    self._emit(segment)
+        except Exception as e:
+            logger.error(f"Error processing streamed segment at index {self._offset}: {str(e)}")
+            self._error = e
+
+    def _emit(self, segment: FunctionSegment) -> None:
+        self.segments.append(segment)
+        logger.info(f"Closed streamed segment {len(self.segments)}: {segment.func_desc}")
+        if self.update_index:
+            self.processor.rag_processor.add_segments([segment])
+        if self.on_segment is not None:
+            self.on_segment(segment)
@@ -0,0 +1,87 @@
+import logging
+import math
+from collections import deque
+from typing import Dict, List
+
+from src.models.llm_client import CHARS_PER_TOKEN, estimate_image_tokens
+from src.processors.image_processor import PreparedImage
+
+logger = logging.getLogger(__name__)
+
+
+class WindowPolicy:
+    """Chooses segmentation window sizes and accounts for the wasted upload
+
+    With adaptive sizing the next window covers a high percentile of recently
+    returned end indices (plus headroom) and grows when the model used the
+    whole window, always staying within [min_size, max_size].
+    """
+    def __init__(self, window_size: int, min_size: int = 4, max_size: int = 16,
+                 adaptive: bool = False, history: int = 8, percentile: float = 0.9,
+                 headroom: float = 1.5):
+        """Initialize policy
+
+        Args:
+            window_size: Initial (or, if not adaptive, fixed) window size
+            min_size: Lower bound of adaptive window sizes
+            max_size: Upper bound of adaptive window sizes
+            adaptive: Whether to adapt the window size
+            history: Number of recent end indices considered
+            percentile: Percentile of recent end indices the window should cover
+            headroom: Factor applied on top of that percentile
+        """
+        self.adaptive = adaptive
+        self.min_size = min_size
+        self.max_size = max_size
+        self.percentile = percentile
+        self.headroom = headroom
+        self.size = self._clamp(window_size) if adaptive else window_size
+        self.recent = deque(maxlen=history)
+        self.windows = 0
+        self.wasted_images = 0
+        self.wasted_tokens = 0
+
+    def _clamp(self, size: int) -> int:
+        return max(self.min_size, min(self.max_size, size))
+
+    def record(self, window_actions: List[str], window_images: List[PreparedImage], consumed: int) -> None:
+        """Log the payload uploaded for nothing and update the next window size
+
+        Args:
+            window_actions: Actions sent with the window
+            window_images: Images sent with the window
+            consumed: Number of actions the closed segment consumed
+        """
+        wasted_images = 0
+        wasted_tokens = sum(len(action) // CHARS_PER_TOKEN for action in window_actions[consumed:])
+        for image in window_images:
+            # A packed image is wasted in proportion to its screenshots past the end index
+            wasted = sum(1 for i in image.indices if i > consumed)
+            if wasted:
+                wasted_images += wasted
+                wasted_tokens += estimate_image_tokens(image.width, image.height) * wasted // len(image.indices)
+        self.windows += 1
+        self.wasted_images += wasted_images
+        self.wasted_tokens += wasted_tokens
+        logger.info(f"Window of {len(window_actions)} actions consumed {consumed}: "
+                    f"{wasted_images} screenshots and ~{wasted_tokens} tokens wasted")
+
+        self.recent.append(consumed)
+        if not self.adaptive:
+            return
+        if consumed >= len(window_actions) and len(window_actions) >= self.size:
+            # The function may continue past the window, look further ahead
+            self.size = self._clamp(self.size + max(1, self.size // 2))
+        else:
+            ordered = sorted(self.recent)
+            covered = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+            self.size = self._clamp(math.ceil(covered * self.headroom))
+
+    def stats(self) -> Dict[str, int]:
+        """Return totals of the wasted upload"""
+        return {
+            'windows': self.windows,
+            'wasted_images': self.wasted_images,
+            'wasted_tokens': self.wasted_tokens,
+            'window_size': self.size,
+        }
@@ -0,0 +1,256 @@
+import logging
+from typing import Iterable, Optional, Tuple
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ('auto', 'flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+
+# Corpus sizes above which 'auto' switches to the next index type
+AUTO_IVF_FLAT_MIN = 20000
+AUTO_IVF_PQ_MIN = 500000
+
+# FAISS k-means wants about this many training points per IVF list
+TRAINING_POINTS_PER_LIST = 39
+# Training points needed for the 256-centroid codebooks of 8-bit product quantizers
+PQ_MIN_TRAINING_POINTS = 256 * TRAINING_POINTS_PER_LIST
+# IVF training is deferred (vectors are kept in a flat index) until there
+# are enough vectors for this many lists
+IVF_MIN_LISTS = 8
+
+
+def resolve_index_type(index_type: str, num_vectors: int) -> str:
+    """Resolve 'auto' to a concrete index type for a corpus size
+
+    Small corpora are searched exactly, larger ones with IVF (which, unlike
+    HNSW, supports removal), and very large ones with IVF-PQ to bound memory.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}, expected one of {INDEX_TYPES}")
+    if index_type != 'auto':
+        return index_type
+    if num_vectors < AUTO_IVF_FLAT_MIN:
+        return 'flat'
+    if num_vectors < AUTO_IVF_PQ_MIN:
+        return 'ivf_flat'
+    return 'ivf_pq'
+
+
+class ANNIndex:
+    """L2 vector index with 64-bit IDs over a selectable FAISS backend
+
+    Flat and HNSW indices are wrapped in IndexIDMap2, IVF indices store the IDs
+    themselves. The index type and number of IVF lists are re-resolved as
+    vectors are added: until an IVF index can be trained with IVF_MIN_LISTS
+    lists its vectors are kept in a flat index, and the index is rebuilt when
+    'auto' resolves to another type or the sensible number of lists doubles.
+    IVF-PQ codes are lossy, so an IVF-PQ index is kept as a rebuildable
+    IVF-Flat index until its codebooks and full number of lists can be
+    trained, converted once, and never rebuilt afterwards.
+    HNSW cannot remove vectors, removed IDs are kept as tombstones and
+    filtered from search results until the index is rebuilt.
+    """
+    def __init__(self, index_type: str = 'auto', nlist: Optional[int] = None, nprobe: int = 8,
+                 pq_m: int = 16, hnsw_m: int = 32, ef_construction: int = 200, ef_search: int = 64):
+        """Initialize index settings, the FAISS index is created on the first add
+
+        Args:
+            index_type: 'auto', 'flat', 'ivf_flat', 'ivf_pq' or 'hnsw'
+            nlist: Maximum number of IVF lists, defaults to about 4 * sqrt(N) of the indexed vectors
+            nprobe: IVF lists visited per query
+            pq_m: Sub-quantizers of IVF-PQ codes (reduced to a divisor of the dimension)
+            hnsw_m: Neighbours per HNSW node
+            ef_construction: HNSW candidate list size while adding
+            ef_search: HNSW candidate list size while searching
+        """
+        resolve_index_type(index_type, 0)
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.kind: Optional[str] = None
+        self.index: Optional[faiss.Index] = None
+        self.tombstones = set()
+
+    @property
+    def d(self) -> int:
+        return self.index.d
+
+    @property
+    def ntotal(self) -> int:
+        """Number of live vectors"""
+        if self.index is None:
+            return 0
+        return self.index.ntotal - len(self.tombstones)
+
+    def _target_nlist(self, num_vectors: int) -> int:
+        return self.nlist or int(4 * np.sqrt(num_vectors))
+
+    def _nlist_for(self, num_vectors: int) -> int:
+        # Keep enough training points per list for k-means
+        return max(1, min(self._target_nlist(num_vectors), num_vectors // TRAINING_POINTS_PER_LIST))
+
+    def _kind_for(self, num_vectors: int) -> str:
+        kind = resolve_index_type(self.index_type, num_vectors)
+        if kind in ('ivf_flat', 'ivf_pq') and num_vectors < IVF_MIN_LISTS * TRAINING_POINTS_PER_LIST:
+            # Too few vectors to train useful lists, search them exactly until more arrive
+            return 'flat'
+        if kind == 'ivf_pq' and num_vectors < max(PQ_MIN_TRAINING_POINTS,
+                                                  self._target_nlist(num_vectors) * TRAINING_POINTS_PER_LIST):
+            # IVF-PQ is never rebuilt, so it is only trained once codebooks and all lists can be
+            return 'ivf_flat'
+        return kind
+
+    @property
+    def trained_nlist(self) -> int:
+        """Number of lists of an IVF index, 0 for other kinds"""
+        if self.kind not in ('ivf_flat', 'ivf_pq'):
+            return 0
+        return faiss.extract_index_ivf(self.index).nlist
+
+    def _needs_rebuild(self, num_vectors: int) -> bool:
+        if self.kind == 'ivf_pq':
+            return False
+        kind = self._kind_for(num_vectors)
+        if kind != self.kind:
+            return True
+        return kind == 'ivf_flat' and self._nlist_for(num_vectors) >= 2 * self.trained_nlist
+
+    def _export(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the live vectors and their IDs, for rebuilding"""
+        if self.kind in ('flat', 'hnsw'):
+            ids = faiss.vector_to_array(self.index.id_map).astype(np.int64)
+            vectors = self.index.index.reconstruct_n(0, self.index.index.ntotal)
+        else:
+            ivf = faiss.extract_index_ivf(self.index)
+            invlists = ivf.invlists
+            id_chunks, vector_chunks = [], []
+            for list_no in range(ivf.nlist):
+                size = invlists.list_size(list_no)
+                if size == 0:
+                    continue
+                list_ids = invlists.get_ids(list_no)
+                codes = invlists.get_codes(list_no)
+                # IVF-Flat codes are the raw float32 vectors
+                id_chunks.append(faiss.rev_swig_ptr(list_ids, size).copy())
+                vector_chunks.append(faiss.rev_swig_ptr(codes, size * invlists.code_size)
+                                     .view(np.float32).reshape(size, ivf.d).copy())
+                invlists.release_ids(list_no, list_ids)
+                invlists.release_codes(list_no, codes)
+            if not id_chunks:
+                return np.empty((0, ivf.d), dtype=np.float32), np.empty(0, dtype=np.int64)
+            ids = np.concatenate(id_chunks).astype(np.int64)
+            vectors = np.vstack(vector_chunks)
+        if self.tombstones:
+            live = ~np.isin(ids, np.fromiter(self.tombstones, dtype=np.int64))
+            ids, vectors = ids[live], vectors[live]
+        return vectors, ids
+
+    def _create(self, vectors: np.ndarray) -> None:
+        num_vectors, dimension = vectors.shape
+        kind = self._kind_for(num_vectors)
+
+        if kind == 'flat':
+            index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+        elif kind == 'hnsw':
+            hnsw = faiss.IndexHNSWFlat(dimension, self.hnsw_m)
+            hnsw.hnsw.efConstruction = self.ef_construction
+            index = faiss.IndexIDMap2(hnsw)
+        else:
+            nlist = self._nlist_for(num_vectors)
+            quantizer = faiss.IndexFlatL2(dimension)
+            if kind == 'ivf_flat':
+                index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+            else:
+                m = max(m for m in range(1, min(self.pq_m, dimension) + 1) if dimension % m == 0)
+                index = faiss.IndexIVFPQ(quantizer, dimension, nlist, m, 8)
+            index.train(vectors)
+            logger.info(f"Trained {kind} index with {nlist} lists on {num_vectors} vectors")
+
+        self.kind = kind
+        self.index = index
+        self.tombstones = set()
+        self._apply_search_parameters()
+
+    def set_search_parameters(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+        """Change the speed/recall trade-off of an existing index"""
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        if self.index is not None:
+            self._apply_search_parameters()
+
+    def _apply_search_parameters(self) -> None:
+        params = faiss.ParameterSpace()
+        if self.kind in ('ivf_flat', 'ivf_pq'):
+            params.set_index_parameter(self.index, "nprobe", self.nprobe)
+        elif self.kind == 'hnsw':
+            params.set_index_parameter(self.index, "efSearch", self.ef_search)
+
+    def add(self, vectors: np.ndarray, ids: Iterable[int]) -> None:
+        """Add vectors with their IDs, creating, training or rebuilding the index if needed"""
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if len(ids) == 0:
+            return
+        if self.index is None:
+            self._create(vectors)
+        elif self._needs_rebuild(self.ntotal + len(ids)):
+            previous_kind, previous_nlist = self.kind, self.trained_nlist
+            old_vectors, old_ids = self._export()
+            vectors = np.vstack([old_vectors, vectors])
+            ids = np.concatenate([old_ids, ids])
+            self._create(vectors)
+            logger.info(f"Rebuilt {previous_kind} index ({previous_nlist} lists) as {self.kind} "
+                        f"({self.trained_nlist} lists) for {len(ids)} vectors")
+        self.index.add_with_ids(vectors, ids)
+
+    def remove(self, ids: Iterable[int]) -> None:
+        """Remove vectors by ID"""
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if len(ids) == 0 or self.index is None:
+            return
+        if self.kind == 'hnsw':
+            self.tombstones.update(ids.tolist())
+        else:
+            self.index.remove_ids(ids)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Search the k nearest live vectors of each query
+
+        Returns:
+            tuple: Distances and IDs, padded with -1 IDs like FAISS
+        """
+        if not self.tombstones:
+            return self.index.search(queries, k)
+        # Fetch enough extra hits to fill k after dropping tombstoned IDs
+        fetch = min(self.index.ntotal, k + len(self.tombstones))
+        out_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if fetch == 0:
+            return out_distances, out_ids
+        distances, ids = self.index.search(queries, fetch)
+        for row in range(len(queries)):
+            keep = [i for i, idx in enumerate(ids[row]) if idx >= 0 and int(idx) not in self.tombstones][:k]
+            out_distances[row, :len(keep)] = distances[row, keep]
+            out_ids[row, :len(keep)] = ids[row, keep]
+        return out_distances, out_ids
+
+    def state(self) -> dict:
+        """Metadata needed besides the FAISS file to restore the index"""
+        return {"kind": self.kind, "tombstones": sorted(self.tombstones)}
+
+    def write(self, path: str) -> None:
+        faiss.write_index(self.index, path)
+
+    def read(self, path: str, state: dict, flags: int = 0) -> None:
+        """Read a FAISS file written by `write` together with its `state`"""
+        self.index = faiss.read_index(path, flags)
+        self.kind = state["kind"]
+        self.tombstones = set(state.get("tombstones", []))
+        self._apply_search_parameters()
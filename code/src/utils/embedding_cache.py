@@ -0,0 +1,101 @@
+import hashlib
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+from PIL import Image
+
+from src.utils.sqlite_cache import QUERY_CHUNK, SQLiteCache
+
+
+def content_digest(value: Any) -> bytes:
+    """Hash the content of an embedding input
+
+    Existing file paths are hashed by file content so renamed or re-recorded
+    screenshots with identical pixels share an entry; other strings (texts,
+    URLs, data URLs) by their characters and PIL images by their pixels.
+    """
+    h = hashlib.sha256()
+    if value is None:
+        h.update(b"none")
+    elif isinstance(value, Image.Image):
+        h.update(f"pil:{value.mode}:{value.size}".encode("utf-8"))
+        h.update(value.tobytes())
+    elif isinstance(value, str) and not value.startswith(("data:", "http://", "https://")) and Path(value).is_file():
+        h.update(b"file:")
+        with open(value, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    else:
+        h.update(b"str:")
+        h.update(str(value).encode("utf-8"))
+    return h.digest()
+
+
+class EmbeddingCache(SQLiteCache):
+    """SQLite-backed cache of embedding vectors with size-based LRU eviction
+
+    Entries are keyed by a namespace (backend, model and any setting that
+    changes the vector) and the content hash of the inputs. Modes are the
+    same as for ResponseCache.
+    """
+    table = "embeddings"
+    value_column = "vector"
+    value_type = "BLOB"
+
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024, mode: str = "use"):
+        """Initialize cache
+
+        Args:
+            path: SQLite database file
+            max_bytes: Maximum total size of stored vectors
+            mode: One of 'use', 'refresh' or 'bypass'
+        """
+        super().__init__(path, max_bytes, mode)
+
+    @staticmethod
+    def make_key(namespace: str, *inputs: Any) -> str:
+        """Build a cache key from a namespace and the content of the inputs of one vector"""
+        h = hashlib.sha256()
+        h.update(namespace.encode("utf-8"))
+        for value in inputs:
+            h.update(b"\0")
+            h.update(content_digest(value))
+        return h.hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Return the cached vectors of the keys found, empty when lookups are disabled"""
+        if self.mode != "use" or not keys:
+            return {}
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), QUERY_CHUNK):
+                chunk = unique[start:start + QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET accessed = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        """Store vectors and evict least recently used entries over max_bytes"""
+        if self.mode == "bypass" or not vectors:
+            return
+        now = time.time()
+        rows = []
+        for key, vector in vectors.items():
+            blob = np.ascontiguousarray(vector, dtype=np.float32).tobytes()
+            rows.append((key, blob, len(blob), now, now))
+        with self._lock:
+            self._insert(rows)
@@ -0,0 +1,53 @@
+from typing import List
+
+from PIL import Image
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """Difference hash of an image
+
+    Args:
+        image: Image to hash
+        hash_size: Hash grid size, the hash has hash_size ** 2 bits
+
+    Returns:
+        int: Perceptual hash
+    """
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | int(pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def dhash_file(path: str, hash_size: int = 8) -> int:
+    """Difference hash of an image file, decoding at reduced size where possible"""
+    with Image.open(path) as image:
+        image.draft('L', (hash_size * 16, hash_size * 16))
+        return dhash(image, hash_size)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits of two hashes"""
+    return bin(a ^ b).count('1')
+
+
+def group_near_duplicates(hashes: List[int], threshold: int) -> List[int]:
+    """Group consecutive near-duplicate frames
+
+    A frame joins the group of the previous frame when its distance to that
+    group's representative (the group's first frame) is at most threshold.
+
+    Returns:
+        List[int]: Index of the representative frame for every frame
+    """
+    representatives = []
+    for i, value in enumerate(hashes):
+        if i > 0 and hamming_distance(value, hashes[representatives[-1]]) <= threshold:
+            representatives.append(representatives[-1])
+        else:
+            representatives.append(i)
+    return representatives
@@ -0,0 +1,176 @@
+import base64
+import logging
+import math
+import multiprocessing
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Iterator, List, Optional, Union
+
+import requests
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def smart_resize(
+    height: int,
+    width: int,
+    factor: int = 28,
+    min_pixels: int = 4 * 28 * 28,
+    max_pixels: int = 16384 * 28 * 28,
+    max_ratio: int = 200
+) -> tuple:
+    """Smart resize image"""
+    def round_by_factor(number: int, factor: int) -> int:
+        return round(number / factor) * factor
+
+    def ceil_by_factor(number: int, factor: int) -> int:
+        return math.ceil(number / factor) * factor
+
+    def floor_by_factor(number: int, factor: int) -> int:
+        return math.floor(number / factor) * factor
+
+    h_bar = max(factor, round_by_factor(height, factor))
+    w_bar = max(factor, round_by_factor(width, factor))
+
+    if h_bar * w_bar > max_pixels:
+        beta = math.sqrt((height * width) / max_pixels)
+        h_bar = floor_by_factor(height / beta, factor)
+        w_bar = floor_by_factor(width / beta, factor)
+    elif h_bar * w_bar < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        h_bar = ceil_by_factor(height * beta, factor)
+        w_bar = ceil_by_factor(width * beta, factor)
+
+    if max(h_bar, w_bar) / min(h_bar, w_bar) > max_ratio:
+        logger.warning(f"Absolute aspect ratio must be smaller than {max_ratio}, got {max(h_bar, w_bar) / min(h_bar, w_bar)}")
+        if h_bar > w_bar:
+            h_bar = w_bar * max_ratio
+        else:
+            w_bar = h_bar * max_ratio
+    return h_bar, w_bar
+
+
+def fetch_image(image: Union[str, Image.Image]) -> Image.Image:
+    """Load image, supports local path, URL and PIL.Image object"""
+    image_obj = None
+    if isinstance(image, Image.Image):
+        image_obj = image
+    elif image.startswith(('http://', 'https://')):
+        image_obj = Image.open(requests.get(image, stream=True).raw)
+    elif image.startswith('file://'):
+        image_obj = Image.open(image[7:])
+    elif image.startswith('data:image'):
+        if 'base64,' in image:
+            _, base64_data = image.split('base64,', 1)
+            data = base64.b64decode(base64_data)
+            image_obj = Image.open(BytesIO(data))
+    else:
+        image_obj = Image.open(image)
+
+    if image_obj is None:
+        raise ValueError(f"Unrecognized image input, support local path, http url, base64 and PIL.Image, got {image}")
+
+    image = image_obj.convert('RGB')
+    width, height = image.size
+    resized_height, resized_width = smart_resize(height, width)
+    image = image.resize((resized_width, resized_height))
+    return image
+
+
+def fetch_images(images: List[Union[str, Image.Image]]) -> List[Image.Image]:
+    """Load and resize a batch of images, run on prefetch workers"""
+    return [fetch_image(image) for image in images]
+
+
+class ImagePrefetcher:
+    """Decodes and resizes image batches ahead of the model
+
+    Batches are prepared on worker threads (PIL releases the GIL while
+    decoding and resizing), up to `depth` batches ahead of the consumer, so at
+    most that many prepared batches are held in memory. Worker processes are
+    opt-in: decoded images are pickled back to the consumer, which usually
+    costs more than decoding them. Falls back to threads when worker processes
+    cannot be started or die, and to inline preparation when workers is 0.
+    """
+    def __init__(self, workers: int = 2, depth: int = 2, processes: bool = False):
+        """Initialize prefetcher, workers are started on first use
+
+        Args:
+            workers: Worker threads or processes, 0 prepares batches inline
+            depth: Batches prepared ahead of the consumer
+            processes: Prepare batches on worker processes instead of threads
+        """
+        self.workers = workers
+        self.depth = max(1, depth)
+        self.processes = processes
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if not self.processes:
+                self._use_threads()
+                return self._executor
+            try:
+                # Forking a process with torch and CUDA threads running can deadlock
+                methods = multiprocessing.get_all_start_methods()
+                method = 'forkserver' if 'forkserver' in methods else 'spawn'
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context(method))
+            except (ImportError, NotImplementedError, OSError, ValueError) as e:
+                logger.warning(f"Worker processes unavailable ({str(e)}), prefetching images on threads")
+                self._use_threads()
+        return self._executor
+
+    def _use_threads(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-prefetch")
+
+    def iterate(self, batches: List[List[Union[str, Image.Image]]]) -> Iterator[List[Image.Image]]:
+        """Yield the prepared images of every batch in order"""
+        if self.workers <= 0:
+            for batch in batches:
+                yield self._fetch_inline(batch)
+            return
+
+        executor = self._get_executor()
+        pending = deque()
+        next_batch = 0
+        try:
+            while next_batch < len(batches) or pending:
+                while next_batch < len(batches) and len(pending) < self.depth:
+                    pending.append((batches[next_batch], executor.submit(fetch_images, batches[next_batch])))
+                    next_batch += 1
+                batch, future = pending.popleft()
+                try:
+                    prepared = future.result()
+                except BrokenProcessPool:
+                    logger.warning("Image prefetch worker died, prefetching images on threads")
+                    self._use_threads()
+                    executor = self._executor
+                    # Batches queued on the broken pool are resubmitted
+                    pending = deque((queued, executor.submit(fetch_images, queued)) for queued, _ in pending)
+                    prepared = self._fetch_inline(batch)
+                except Exception as e:
+                    logger.error(f"Error loading image: {str(e)}")
+                    raise
+                yield prepared
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    @staticmethod
+    def _fetch_inline(batch: List[Union[str, Image.Image]]) -> List[Image.Image]:
+        try:
+            return fetch_images(batch)
+        except Exception as e:
+            logger.error(f"Error loading image: {str(e)}")
+            raise
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,64 @@
+import hashlib
+import time
+from typing import List, Optional
+
+from src.utils.sqlite_cache import SQLiteCache
+
+
+class ResponseCache(SQLiteCache):
+    """SQLite-backed cache of LLM responses with size-based LRU eviction, see SQLiteCache for the modes"""
+    table = "responses"
+    value_column = "response"
+    value_type = "TEXT"
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024, mode: str = "use"):
+        """Initialize cache
+
+        Args:
+            path: SQLite database file
+            max_bytes: Maximum total size of stored responses
+            mode: One of 'use', 'refresh' or 'bypass'
+        """
+        super().__init__(path, max_bytes, mode)
+
+    @staticmethod
+    def make_key(model: str, prompt: str, images: Optional[List[str]] = None) -> str:
+        """Build a cache key from model name, prompt text and image content hashes"""
+        h = hashlib.sha256()
+        h.update(model.encode("utf-8"))
+        h.update(b"\0")
+        h.update(prompt.encode("utf-8"))
+        for image in images or []:
+            h.update(b"\0")
+            h.update(hashlib.sha256(image.encode("utf-8")).digest())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return cached response, or None on a miss or when lookups are disabled"""
+        if self.mode != "use":
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        """Store response and evict least recently used entries over max_bytes"""
+        if self.mode == "bypass":
+            return
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._insert([(key, response, size, now, now)])
+
+    def delete(self, key: str) -> None:
+        """Remove an entry, e.g. a response that turned out to be unusable"""
+        if self.mode == "bypass":
+            return
+        with self._lock:
+            self._delete(key)
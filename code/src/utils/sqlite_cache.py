@@ -0,0 +1,126 @@
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+CACHE_MODES = ("use", "refresh", "bypass")
+
+# SQLite limits the number of host parameters of a statement
+QUERY_CHUNK = 500
+# Least recently used entries fetched per eviction round
+_EVICT_CHUNK = 64
+
+
+class SQLiteCache:
+    """Base of the SQLite-backed caches with size-based LRU eviction
+
+    Subclasses set the table name and the name and SQL type of the value column;
+    every table also stores the entry size and its created and accessed times.
+    The total size is summed once when the cache is opened and then kept up
+    to date, so inserts and evictions do not scan the table.
+
+    Modes:
+        use: read and write the cache
+        refresh: skip lookups but store fresh entries
+        bypass: neither read nor write
+    """
+    table = ""
+    value_column = ""
+    value_type = ""
+
+    def __init__(self, path: str, max_bytes: int, mode: str = "use"):
+        """Initialize cache
+
+        Args:
+            path: SQLite database file
+            max_bytes: Maximum total size of stored values
+            mode: One of 'use', 'refresh' or 'bypass'
+        """
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Invalid cache mode: {mode}, expected one of {CACHE_MODES}")
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self.total_bytes = 0
+        if mode != "bypass":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                f"key TEXT PRIMARY KEY, {self.value_column} {self.value_type} NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            # The index was once named idx_accessed whatever the table, which fails for a second table in one file
+            self._conn.execute("DROP INDEX IF EXISTS idx_accessed")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_accessed ON {self.table}(accessed)")
+            self._conn.commit()
+            self.total_bytes = self._conn.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM {self.table}"
+            ).fetchone()[0]
+
+    def _stored_sizes(self, keys: List[str]) -> int:
+        """Total size of the stored entries among keys"""
+        total = 0
+        for start in range(0, len(keys), QUERY_CHUNK):
+            chunk = keys[start:start + QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            total += self._conn.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM {self.table} WHERE key IN ({placeholders})", chunk
+            ).fetchone()[0]
+        return total
+
+    def _insert(self, rows: List[tuple]) -> None:
+        """Insert or replace (key, value, size, created, accessed) rows and evict, the caller holds the lock"""
+        # Only the last row of a repeated key is kept
+        rows = list({row[0]: row for row in rows}.values())
+        replaced = self._stored_sizes([row[0] for row in rows])
+        self._conn.executemany(
+            f"INSERT OR REPLACE INTO {self.table} (key, {self.value_column}, size, created, accessed) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        self.total_bytes += sum(row[2] for row in rows) - replaced
+        self._evict()
+        self._conn.commit()
+
+    def _delete(self, key: str) -> None:
+        """Delete an entry, the caller holds the lock"""
+        self.total_bytes -= self._stored_sizes([key])
+        self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        self._conn.commit()
+
+    def _evict(self) -> None:
+        """Delete least recently used entries over max_bytes, the caller holds the lock and commits"""
+        evicted = 0
+        while self.total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                f"SELECT key, size FROM {self.table} ORDER BY accessed LIMIT ?", (_EVICT_CHUNK,)
+            ).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+            for key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.total_bytes -= size
+                evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} cached {self.table}")
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters of this session"""
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,30 @@
+from PIL import Image
+
+from src.processors.image_processor import WindowImagePreparer
+
+
+def _save_screenshot(path, size, mode='RGB'):
+    Image.new(mode, size, (120, 180, 240) if mode == 'RGB' else (120, 180, 240, 255)).save(path)
+    return str(path)
+
+
+def test_prepare_rgb_screenshot_within_max_size(tmp_path):
+    # Nothing is resized or converted, the image must still be loaded before its file is closed
+    screenshot = _save_screenshot(tmp_path / "small.png", (720, 800))
+    preparer = WindowImagePreparer(max_size=(800, 800), max_workers=1)
+
+    prepared = preparer.prepare([screenshot, screenshot], near_duplicate_threshold=0)
+
+    # The identical second screenshot is dropped as a near-duplicate
+    assert len(prepared) == 1
+    assert (prepared[0].width, prepared[0].height) == (720, 800)
+    assert prepared[0].url.startswith("data:image/jpeg;base64,")
+
+
+def test_prepare_rgba_screenshot_is_downscaled(tmp_path):
+    screenshot = _save_screenshot(tmp_path / "large.png", (1080, 2400), mode='RGBA')
+    preparer = WindowImagePreparer(max_size=(800, 800), max_workers=1)
+
+    prepared = preparer.prepare([screenshot])
+
+    assert max(prepared[0].width, prepared[0].height) == 800